@@ -1,3 +1,4 @@
+import matplotlib.pyplot as plt
 from testing import *
 
 fig = t9()[0]
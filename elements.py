@@ -3,9 +3,47 @@
 Contains the Element base class, and all derived classes.
 """
 
-import numpy as np, copy
+import numpy as np, copy, json, hashlib
 from collections.abc import Iterable
-import opticsutils as ou
+import kernels as k, ray as r, materials as m
+
+def _indices(n, wavelength):
+    """
+    Evaluates an index function for the wavelengths of a bundle (None, a single value, or an array).
+    """
+
+    if wavelength is None or np.ndim(wavelength) == 0:
+        return n(wavelength)
+    values, inverse = np.unique(wavelength, return_inverse=True)
+    return np.array([n(x) for x in values], dtype=float)[inverse]
+
+def _subset(wavelength, idx):
+    """
+    Selects the wavelengths of the rays at indices idx of a bundle.
+    """
+
+    if wavelength is None or np.ndim(wavelength) == 0:
+        return wavelength
+    return wavelength[idx]
+
+def from_dict(d):
+    """
+    Builds a system, or a single element, from a dictionary as produced by their to_dict methods.
+    """
+
+    if "elements" in d:
+        return System(elements=[from_dict(x) for x in d["elements"]])
+    types = {x.__name__: x for x in (SphericalRefractor, SphericalReflector, AsphericRefractor, AsphericReflector, OutputPlane, Fibre)}
+    params = dict(d)
+    return types[params.pop("type")](**params)
+
+def load(path):
+    """
+    Loads a system from a JSON file written by System.save.
+    """
+
+    with open(path) as f:
+        return from_dict(json.load(f))
 
 class System:
     """
@@ -17,6 +55,8 @@ class System:
             self.__elements = []
         else:
             self.__elements = elements
+        #state of the last trace: the input bundle, (element, version) pairs, and the bundle after each element
+        self.__input, self.__traced, self.__checkpoints = None, [], []
         
     def append(self, element):
         """
@@ -24,6 +64,13 @@ class System:
         """
         
         self.__elements.append(element)
+
+    def elements(self):
+        """
+        Returns the list of elements in the system.
+        """
+
+        return self.__elements
         
     def propagate(self, ray):
         """
@@ -32,6 +79,38 @@ class System:
         for elem in self.__elements:
             elem.propagate(ray)
     
+    def trace(self, bundle):
+        """
+        Propagates a copy of a RayBundle through the system, and returns it (the bundle passed is not modified).
+
+        The bundle's state after each element is kept. If the same rays (with the same record mode) are traced again, only the elements
+        from the first one changed since (by set, or by replacing or adding elements) are traced again, starting from the state before it.
+        """
+
+        same = not self.__input is None and len(self.__input) == len(bundle) and self.__input.dtype() == bundle.dtype() \
+            and self.__input.record() == bundle.record() \
+            and all([np.array_equal(x, y) for x, y in ((self.__input.pos(), bundle.pos()), (self.__input.dirn(), bundle.dirn()),
+                                                    (self.__input.terminated(), bundle.terminated()),
+                                                    (self.__input.wavelength(), bundle.wavelength()))])
+
+        #first element that differs from the last trace
+        start = 0
+        if same:
+            while start < min(len(self.__traced), len(self.__elements)) and self.__traced[start] == (self.__elements[start], self.__elements[start].version()):
+                start += 1
+        else:
+            self.__input = bundle.copy()
+        self.__traced, self.__checkpoints = self.__traced[:start], self.__checkpoints[:start]
+
+        state = self.__checkpoints[-1] if start > 0 else self.__input
+        for elem in self.__elements[start:]:
+            state = state.copy()
+            elem.propagate(state)
+            self.__traced.append((elem, elem.version()))
+            self.__checkpoints.append(state)
+
+        return state.copy()
+
     def get_paraxial(self):
         """
         Returns the paraxial distance for the entire system, this is just the minimum paraxial distance.
@@ -41,6 +120,28 @@ class System:
     def copy(self):
         return System(elements=self.__elements.copy())
 
+    def to_dict(self):
+        """
+        Returns a description of the system as a dictionary of plain values, see elements.from_dict.
+        """
+
+        return {"elements": [x.to_dict() for x in self.__elements]}
+
+    def save(self, path):
+        """
+        Saves the system as JSON, see elements.load.
+        """
+
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=4)
+
+    def fingerprint(self):
+        """
+        Returns a hash of the system description, equal for systems that trace identically, for use as a cache key.
+        """
+
+        return hashlib.sha1(json.dumps(self.to_dict(), sort_keys=True).encode()).hexdigest()
+
 class Element:
 
     def __repr__(self):
@@ -52,6 +153,25 @@ class Element:
     def get_paraxial(self):
         raise NotImplementedError()
 
+    def perturb(self, **deltas):
+        raise NotImplementedError()
+
+    def to_dict(self):
+        raise NotImplementedError()
+
+    def set(self, **params):
+        raise NotImplementedError()
+
+    def version(self):
+        """
+        Returns a counter that increases whenever the element's parameters are changed with set.
+        """
+
+        return self.__dict__.get("_version", 0)
+
+    def _changed(self):
+        self._version = self.version() + 1
+
 class SphericalElement(Element):
     """
     Abstract spherical element base class.
@@ -80,6 +200,83 @@ class SphericalElement(Element):
         else:
             return 1
 
+    def perturb(self, z0=0, curvature=0):
+        """
+        Returns a copy of the element with its parameters offset by the given amounts.
+        """
+
+        elem = copy.copy(self)
+        elem._z0 += z0
+        elem._curv += curvature
+        return elem
+
+    def set(self, z0=None, curvature=None):
+        """
+        Changes the parameters of the element in place, those left as None are unchanged.
+        """
+
+        if not z0 is None:
+            self._z0 = z0
+        if not curvature is None:
+            self._curv = curvature
+        self._changed()
+
+    def _normal(self, intercept, dirn):
+        """
+        Gets the (unnormalised) surface normal at an intercept, facing against a ray travelling in direction dirn.
+        """
+        if (self._curv > 0 and dirn[2] > 0) or (self._curv < 0 and dirn[2] < 0):
+            return intercept - self._center()
+        elif (self._curv < 0 and dirn[2] > 0) or (self._curv > 0 and dirn[2] < 0):
+            return self._center() - intercept
+        else:
+            return np.array([0,0,-1.0 * dirn[2] / abs(dirn[2])])
+
+    def _normals(self, pts, dirn):
+        """
+        Vectorised version of _normal for (N, 3) arrays of intercepts and directions, the normals returned are normalised.
+        """
+        if self._curv != 0:
+            normals = np.sign(self._curv * dirn[:, 2])[:, None] * (pts - self._center())
+        else:
+            normals = np.zeros_like(pts)
+            normals[:, 2] = -np.sign(dirn[:, 2])
+        return normals / np.linalg.norm(normals, axis=1)[:, None]
+
+    def _distances(self, pos, dirn):
+        """
+        Calculates the distance along each ray to the surface, for (N, 3) arrays of positions and directions.
+        Returns the distances, and a mask of the rays that meet the surface at all (ignoring the aperture and direction of travel).
+        """
+
+        if self._curv != 0:
+            #same choice of intersection as _intercept
+            r = pos - self._center()
+            a = -np.sum(r * dirn, axis=1)
+            det = a**2 - np.sum(r**2, axis=1) + (1/self._curv)**2
+            meets = det >= 0
+            b = np.sqrt(np.where(meets, det, 0))
+            far = ((self._curv < 0) & (dirn[:, 2] > 0)) | ((self._curv > 0) & (dirn[:, 2] < 0))
+            return np.where(far, a + b, a - b), meets
+        else:
+            meets = dirn[:, 2] != 0
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return np.where(meets, (self._z0 - pos[:, 2]) / dirn[:, 2], 0), meets
+
+    def _intercepts(self, pos, dirn):
+        """
+        Vectorised version of _intercept for (N, 3) arrays of positions and directions.
+        Returns the intercepts, and a mask of the rays that hit the surface ahead of them and within the aperture.
+        Intercepts are nan for rays whose distance could not be resolved, which should be terminated.
+        """
+
+        l, hit = self._distances(pos, dirn)
+        hit &= l >= 0
+        pts = pos + l[:, None] * dirn
+        if not self._apt is None:
+            hit &= np.sqrt(pts[:, 0]**2 + pts[:, 1]**2) <= self._apt
+        return pts, hit
+
     def _intercept(self, ray):
         """
         Calculates the first intercept of a ray with the surface described.
@@ -132,27 +329,53 @@ class SphericalRefractor(SphericalElement):
         curvature: 1/radius of curvature, this is negative if the centre of curvature is smaller than z0.
         n1: refractive index on the side facing negative z.
         n2: refractive index on the side facing positive z.
-        Both n1, n2 can be functions of wavelength, or constant values. If functions, they should be able to handle and provide output for input None.
+        Both n1, n2 can be constant values, material names, index objects from the materials module, or functions of wavelength.
+        If functions, they should be able to handle and provide output for input None, and the refractor can not be saved or pickled.
         apt: aperture radius.
         """
 
-        if callable(n1):
-            self.__n1 = n1
-        else:
-            self.__n1 = lambda x : n1
-        if callable(n2):
-            self.__n2 = n2
-        else:
-            self.__n2 = lambda x : n2
+        self._n1, self._n2 = m.index(n1), m.index(n2)
         
         super().__init__(z0, curvature, apt)
 
         
     def __repr__(self):
         if not self._apt is None:
-            return "elements.SphericalRefractor({:g}, {:g}, {}, {}, {:g})".format(self._z0, self._curv, self.__n1, self.__n2, self._apt)
+            return "elements.SphericalRefractor({:g}, {:g}, {}, {}, {:g})".format(self._z0, self._curv, self._n1, self._n2, self._apt)
         else:
-            return "elements.SphericalRefractor({:g}, {:g}, {}, {})".format(self._z0, self._curv, self.__n1, self.__n2)
+            return "elements.SphericalRefractor({:g}, {:g}, {}, {})".format(self._z0, self._curv, self._n1, self._n2)
+
+    def perturb(self, z0=0, curvature=0, n1=0, n2=0):
+        """
+        Returns a copy of the refractor with its parameters offset by the given amounts.
+        n1, n2 are added to the refractive index at every wavelength.
+        """
+
+        elem = super().perturb(z0, curvature)
+        if n1 != 0:
+            elem._n1 = m.OffsetIndex(self._n1, n1)
+        if n2 != 0:
+            elem._n2 = m.OffsetIndex(self._n2, n2)
+        return elem
+
+    def set(self, z0=None, curvature=None, n1=None, n2=None):
+        """
+        Changes the parameters of the refractor in place, those left as None are unchanged.
+        """
+
+        super().set(z0, curvature)
+        if not n1 is None:
+            self._n1 = m.index(n1)
+        if not n2 is None:
+            self._n2 = m.index(n2)
+
+    def to_dict(self):
+        """
+        Returns a description of the refractor as a dictionary of plain values.
+        """
+
+        return {"type": type(self).__name__, "z0": float(self._z0), "curvature": float(self._curv),
+                "n1": m.spec(self._n1), "n2": m.spec(self._n2), "apt": None if self._apt is None else float(self._apt)}
 
     def propagate(self, ray):
         """
@@ -161,7 +384,11 @@ class SphericalRefractor(SphericalElement):
         If the ray totally internally reflects, the ray will be terminated.
         
         If passed an iterable, will propagate each element through the refractor. Returns a set of tuples representing notable function outputs with the index of the element that produced it.
+        If passed a RayBundle, all its rays are propagated in one vectorised step.
         """
+        if isinstance(ray, r.RayBundle):
+            return self._propagate_bundle(ray)
+
         if isinstance(ray, Iterable):
             res = [self.propagate(r) for r in ray]
             if all([x is None for x in res]):
@@ -176,24 +403,40 @@ class SphericalRefractor(SphericalElement):
         
         if intercept is None:
             return False
+
+        #intercepts that could not be resolved (see AsphericElement._distances) are nan
+        if np.isnan(intercept[2]):
+            ray.terminate()
+            return False
         
-        if (self._curv > 0 and ray.dirn()[2] > 0) or (self._curv < 0 and ray.dirn()[2] < 0):
-            surface_normal = intercept - self._center()
-        elif (self._curv < 0 and ray.dirn()[2] > 0) or (self._curv > 0 and ray.dirn()[2] < 0):
-            surface_normal = self._center() - intercept
-        else:
-            surface_normal = np.array([0,0,-1.0 * ray.dirn()[2] / abs(ray.dirn()[2])])
+        surface_normal = self._normal(intercept, ray.dirn())
             
         surface_normal /= np.linalg.norm(surface_normal)
 
-        refracted_dirn = ou.refract(ray.dirn(), surface_normal, self.__n1(ray.wavelength()), self.__n2(ray.wavelength()))
+        refracted_dirn = k.refract(ray.dirn(), surface_normal, self._n1(ray.wavelength()), self._n2(ray.wavelength()))
 
         if not refracted_dirn is None:
-            ray.append(intercept, refracted_dirn)
+            ray.append(intercept, refracted_dirn, self)
         else:
             ray.terminate()
             return False
         
+    def _propagate_bundle(self, bundle):
+        """
+        Propagates a RayBundle through the element, with the same outcomes as propagating each ray.
+        """
+
+        live = np.flatnonzero(~bundle.terminated())
+        pts, hit = self._intercepts(bundle.pos()[live].astype(float), bundle.dirn()[live].astype(float))
+        bundle.terminate(live[np.isnan(pts[:, 2])])
+        idx, pts = live[hit], pts[hit]
+        dirn = bundle.dirn()[idx]
+        normals = self._normals(pts, dirn.astype(float)).astype(bundle.dtype())
+
+        wavelength = _subset(bundle.wavelength(), idx)
+        refracted_dirn, tir = k.refract_many(dirn, normals, _indices(self._n1, wavelength), _indices(self._n2, wavelength))
+        bundle.append(idx, pts, refracted_dirn, self)
+
 class SphericalReflector(SphericalElement):
     """
     Represents a spherical reflecting surface.
@@ -217,6 +460,14 @@ class SphericalReflector(SphericalElement):
             return "elements.SphericalReflector({:g}, {:g}, {:g})".format(self._z0, self._curv, self._apt)
         else:
             return "elements.SphericalReflector({:g}, {:g})".format(self._z0, self._curv)
+
+    def to_dict(self):
+        """
+        Returns a description of the reflector as a dictionary of plain values.
+        """
+
+        return {"type": type(self).__name__, "z0": float(self._z0), "curvature": float(self._curv),
+                "apt": None if self._apt is None else float(self._apt), "reverse_mirror": self.__reverse}
     
     def propagate(self, ray):
         """
@@ -225,8 +476,12 @@ class SphericalReflector(SphericalElement):
         If the ray hits the non-reflective side, the ray will be terminated.
 
         If passed an iterable, will propagate each element through the reflector. Returns a set of tuples representing notable function outputs with the index of the element that produced it.
+        If passed a RayBundle, all its rays are propagated in one vectorised step.
         """
         
+        if isinstance(ray, r.RayBundle):
+            return self._propagate_bundle(ray)
+
         if isinstance(ray, Iterable):
             res = [self.propagate(r) for r in ray]
             if all([x is None for x in res]):
@@ -241,13 +496,13 @@ class SphericalReflector(SphericalElement):
         
         if intercept is None:
             return False
+
+        #intercepts that could not be resolved (see AsphericElement._distances) are nan
+        if np.isnan(intercept[2]):
+            ray.terminate()
+            return False
             
-        if (self._curv > 0 and ray.dirn()[2] > 0) or (self._curv < 0 and ray.dirn()[2] < 0):
-            surface_normal = intercept - self._center()
-        elif (self._curv < 0 and ray.dirn()[2] > 0) or (self._curv > 0 and ray.dirn()[2] < 0):
-            surface_normal = self._center() - intercept
-        else:
-            surface_normal = np.array([0,0,-1.0 * ray.dirn()[2] / abs(ray.dirn()[2])])
+        surface_normal = self._normal(intercept, ray.dirn())
 
         #terminate if hits non-reflective
         if (surface_normal[2] < 0 and self.__reverse) or (surface_normal[2] > 0 and not self.__reverse):
@@ -256,14 +511,280 @@ class SphericalReflector(SphericalElement):
 
         surface_normal /= np.linalg.norm(surface_normal)
 
-        reflected_dirn = ou.reflect(ray.dirn(), surface_normal)
+        reflected_dirn = k.reflect(ray.dirn(), surface_normal)
 
         if not reflected_dirn is None:
-            ray.append(intercept, reflected_dirn)
+            ray.append(intercept, reflected_dirn, self)
         else:
             ray.terminate()
             return False
             
+    def _propagate_bundle(self, bundle):
+        """
+        Propagates a RayBundle through the element, with the same outcomes as propagating each ray.
+        """
+
+        live = np.flatnonzero(~bundle.terminated())
+        pts, hit = self._intercepts(bundle.pos()[live].astype(float), bundle.dirn()[live].astype(float))
+        bundle.terminate(live[np.isnan(pts[:, 2])])
+        idx, pts = live[hit], pts[hit]
+        dirn = bundle.dirn()[idx]
+        normals = self._normals(pts, dirn.astype(float))
+
+        #terminate if hits non-reflective
+        wrong = normals[:, 2] < 0 if self.__reverse else normals[:, 2] > 0
+        bundle.terminate(idx[wrong])
+
+        normals = normals[~wrong].astype(bundle.dtype())
+        bundle.append(idx[~wrong], pts[~wrong], k.reflect_many(dirn[~wrong], normals), self)
+
+class AsphericElement(SphericalElement):
+    """
+    Abstract conic/even asphere element base class.
+
+    The surface sag is z - z0 = c r^2 / (1 + sqrt(1 - (1 + k) c^2 r^2)) + A_4 r^4 + A_6 r^6 + ...
+    where c is the curvature, k the conic constant and A_n the aspheric coefficients.
+    """
+
+    #number of Newton steps used to find intercepts, and the tolerance (in m) for a ray to be counted as converged
+    NEWTON_STEPS = 8
+    NEWTON_TOL = 1e-14
+    #samples along each ray used to bracket the first intercept where Newton's method fails, and to check for a crossing
+    #before the Newton root (2 samples, at either end, detect an odd number of earlier crossings)
+    BRACKET_SAMPLES = 256
+    CHECK_SAMPLES = 2
+
+    def _sag(self, s):
+        """
+        Returns the sag, and its derivative with respect to s, for an array of s = x^2 + y^2.
+        Both are nan where the conic is not defined.
+        """
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            root = np.sqrt(1 - (1 + self._conic) * self._curv**2 * s)
+            dsag = self._curv / (2 * root)
+        sag = self._curv * s / (1 + root)
+        for i, a in enumerate(self._coeffs):
+            sag = sag + a * s**(i + 2)
+            dsag = dsag + a * (i + 2) * s**(i + 1)
+        return sag, dsag
+
+    def _extent(self):
+        """
+        Returns the largest radius of the surface: the aperture, or the edge of the conic, or None if it is unbounded.
+        """
+
+        if not self._apt is None:
+            return self._apt
+        if (1 + self._conic) * self._curv**2 > 0:
+            return ((1 + self._conic) * self._curv**2)**-0.5
+        return None
+
+    def _span(self, pos, dirn, r_max):
+        """
+        Returns the range of distances (lo, hi) along each ray within the region the surface occupies: the cylinder r <= r_max,
+        and the slab between the least and greatest sag. lo > hi for rays that do not cross it ahead of them.
+        """
+
+        sag = self._sag(np.linspace(0, r_max**2, self.BRACKET_SAMPLES))[0]
+        z = self._z0 + np.array([np.nanmin(sag), np.nanmax(sag)])
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = (z[None, :] - pos[:, 2:]) / dirn[:, 2:]
+            inside = (pos[:, 2] >= z[0]) & (pos[:, 2] <= z[1])
+            flat = dirn[:, 2] == 0
+            lo = np.where(flat, np.where(inside, -np.inf, np.inf), np.min(t, axis=1))
+            hi = np.where(flat, np.where(inside, np.inf, -np.inf), np.max(t, axis=1))
+
+            a = dirn[:, 0]**2 + dirn[:, 1]**2
+            b = pos[:, 0] * dirn[:, 0] + pos[:, 1] * dirn[:, 1]
+            c = pos[:, 0]**2 + pos[:, 1]**2 - r_max**2
+            det = np.sqrt(b**2 - a * c)
+            axial = a == 0
+            lo = np.maximum(lo, np.where(axial, np.where(c <= 0, -np.inf, np.inf), np.where(np.isfinite(det), (-b - det) / a, np.inf)))
+            hi = np.minimum(hi, np.where(axial, np.where(c <= 0, np.inf, -np.inf), np.where(np.isfinite(det), (-b + det) / a, -np.inf)))
+
+        return np.maximum(lo, 0), hi
+
+    def _bracket(self, pos, dirn, lo, hi, r_max, samples):
+        """
+        Finds the first sign change of the surface equation along each ray, sampled between distances lo and hi,
+        and bisects it to NEWTON_TOL. Returns the distances, and a mask of the rays with a sign change.
+        """
+
+        def f(l, rows):
+            x, y = pos[rows, 0:1] + l * dirn[rows, 0:1], pos[rows, 1:2] + l * dirn[rows, 1:2]
+            #the edge of the conic is within rounding of r_max
+            return pos[rows, 2:] + l * dirn[rows, 2:] - self._z0 - self._sag(np.minimum(x**2 + y**2, r_max**2))[0]
+
+        ls = lo[:, None] + (hi - lo)[:, None] * np.linspace(0, 1, samples)[None, :]
+        fs = f(ls, slice(None))
+        change = (fs[:, :-1] == 0) | (np.sign(fs[:, :-1]) * np.sign(fs[:, 1:]) < 0)
+        found = np.flatnonzero(np.any(change, axis=1))
+        j = np.argmax(change[found], axis=1)
+        a, b, fa = ls[found, j], ls[found, j + 1], fs[found, j]
+
+        for i in range(200):
+            if not np.any(b - a > self.NEWTON_TOL):
+                break
+            mid = (a + b) / 2
+            fm = f(mid[:, None], found)[:, 0]
+            left = np.sign(fm) * np.sign(fa) <= 0
+            a, b, fa = np.where(left, a, mid), np.where(left, mid, b), np.where(left, fa, fm)
+
+        l = np.full(len(pos), np.nan)
+        l[found] = np.where(fa == 0, a, (a + b) / 2)
+        return l, np.isfinite(l)
+
+    def _distances(self, pos, dirn):
+        """
+        Calculates the distance along each ray to the surface, for (N, 3) arrays of positions and directions.
+
+        Starts from the closed form for the sphere of the same curvature (or the vertex plane, for rays that miss the sphere),
+        then takes a fixed number of Newton steps, only updating rays that have not yet converged.
+        Rays that do not converge, or that cross the surface before their Newton root, are solved by bracketing the first
+        intercept within the region the surface occupies. This needs a bounded surface (an aperture, or an ellipsoid),
+        otherwise rays that do not converge can not be resolved, and their distances are nan.
+        Returns the distances, and a mask of the rays that meet the surface.
+        """
+
+        l, meets = SphericalElement._distances(self, pos, dirn)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            l = np.where(meets, l, (self._z0 - pos[:, 2]) / dirn[:, 2])
+        active = np.isfinite(l)
+        converged = np.zeros(len(l), dtype=bool)
+
+        for i in range(self.NEWTON_STEPS):
+            if not np.any(active):
+                break
+            p, d, l_a = pos[active], dirn[active], l[active]
+            x, y = p[:, 0] + l_a * d[:, 0], p[:, 1] + l_a * d[:, 1]
+            sag, dsag = self._sag(x**2 + y**2)
+            f = p[:, 2] + l_a * d[:, 2] - self._z0 - sag
+            df = d[:, 2] - 2 * dsag * (x * d[:, 0] + y * d[:, 1])
+            with np.errstate(divide="ignore", invalid="ignore"):
+                step = f / df
+            l[active] = l_a - step
+
+            #rays leaving the conic, or stalling, are dropped
+            done = abs(step) < self.NEWTON_TOL
+            failed = ~np.isfinite(step)
+            idx = np.flatnonzero(active)
+            converged[idx[done]] = True
+            active[idx[done | failed]] = False
+
+        r_max = self._extent()
+        if r_max is None:
+            l[~converged] = np.nan
+            return l, converged
+
+        lo, hi = self._span(pos, dirn, r_max)
+        #converged rays are checked for an earlier crossing
+        check = np.flatnonzero(converged & (l > lo))
+        if len(check):
+            l_c, earlier = self._bracket(pos[check], dirn[check], lo[check], np.minimum(l[check], hi[check]) * (1 - 1e-9),
+                                         r_max, self.CHECK_SAMPLES)
+            l[check[earlier]] = l_c[earlier]
+
+        retry = np.flatnonzero(~converged & (hi >= lo))
+        l[~converged] = 0
+        if len(retry):
+            l_r, found = self._bracket(pos[retry], dirn[retry], lo[retry], hi[retry], r_max, self.BRACKET_SAMPLES)
+            l[retry[found]] = l_r[found]
+            converged[retry[found]] = True
+
+        return l, converged
+
+    def _normals(self, pts, dirn):
+        """
+        Calculates the normalised surface normals at (N, 3) arrays of intercepts, facing against rays travelling in directions dirn.
+        """
+
+        sag, dsag = self._sag(pts[:, 0]**2 + pts[:, 1]**2)
+        normals = np.column_stack([-2 * pts[:, 0] * dsag, -2 * pts[:, 1] * dsag, np.ones(len(pts))])
+        normals /= np.linalg.norm(normals, axis=1)[:, None]
+        normals[np.sum(normals * dirn, axis=1) > 0] *= -1
+        return normals
+
+    def _normal(self, intercept, dirn):
+        """
+        Gets the surface normal at an intercept, facing against a ray travelling in direction dirn.
+        """
+
+        return self._normals(intercept[None], dirn[None])[0]
+
+    def _intercept(self, ray):
+        """
+        Calculates the first intercept of a ray with the surface described.
+        """
+
+        pts, hit = self._intercepts(ray.pos()[None], ray.dirn()[None])
+        #unresolved intercepts are returned as nan, for the ray to be terminated
+        return pts[0] if hit[0] or np.isnan(pts[0, 2]) else None
+
+    def to_dict(self):
+        """
+        Returns a description of the element as a dictionary of plain values.
+        """
+
+        d = super().to_dict()
+        d.update({"conic": float(self._conic), "coefficients": [float(x) for x in self._coeffs]})
+        return d
+
+    def set(self, conic=None, coefficients=None, **params):
+        """
+        Changes the parameters of the element in place, those left as None are unchanged.
+        Other parameters are passed on, as for the spherical element.
+        """
+
+        if not conic is None:
+            self._conic = conic
+        if not coefficients is None:
+            self._coeffs = tuple(coefficients)
+        super().set(**params)
+
+class AsphericRefractor(AsphericElement, SphericalRefractor):
+    """
+    Represents a conic or even aspheric refracting surface.
+    """
+
+    def __init__(self, z0, curvature, n1, n2, conic=0, coefficients=(), apt=None):
+        """
+        z0: the intersection of the element with the z axis.
+        curvature: 1/radius of curvature at the vertex, signed as for SphericalRefractor.
+        n1, n2: refractive indices, as for SphericalRefractor.
+        conic: the conic constant k (0 sphere, -1 paraboloid, < -1 hyperboloid, otherwise ellipsoid).
+        coefficients: the aspheric coefficients (A_4, A_6, ...) of r^4, r^6, ...
+        apt: aperture radius.
+        """
+
+        self._conic, self._coeffs = conic, tuple(coefficients)
+        SphericalRefractor.__init__(self, z0, curvature, n1, n2, apt)
+
+    def __repr__(self):
+        return "elements.AsphericRefractor({:g}, {:g}, {}, {}, {:g}, {}, {})".format(self._z0, self._curv, self._n1, self._n2, self._conic, self._coeffs, self._apt)
+
+class AsphericReflector(AsphericElement, SphericalReflector):
+    """
+    Represents a conic or even aspheric reflecting surface.
+    """
+
+    def __init__(self, z0, curvature, conic=0, coefficients=(), apt=None, reverse_mirror=False):
+        """
+        z0: the intersection of the element with the z axis.
+        curvature: 1/radius of curvature at the vertex, signed as for SphericalReflector.
+        conic: the conic constant k (0 sphere, -1 paraboloid, < -1 hyperboloid, otherwise ellipsoid).
+        coefficients: the aspheric coefficients (A_4, A_6, ...) of r^4, r^6, ...
+        apt: aperture radius.
+        reverse_mirror: as for SphericalReflector.
+        """
+
+        self._conic, self._coeffs = conic, tuple(coefficients)
+        SphericalReflector.__init__(self, z0, curvature, apt, reverse_mirror)
+
+    def __repr__(self):
+        return "elements.AsphericReflector({:g}, {:g}, {:g}, {}, {})".format(self._z0, self._curv, self._conic, self._coeffs, self._apt)
+
 class OutputPlane(Element):
     """
     Represents a virtual plane that does not modify rays.
@@ -298,14 +819,41 @@ class OutputPlane(Element):
 
         return 1
 
+    def perturb(self, z0=0):
+        """
+        Returns a copy of the plane offset by the given amount.
+        """
+
+        return OutputPlane(self._z0 + z0)
+
+    def set(self, z0=None):
+        """
+        Moves the plane in place, if z0 is not None.
+        """
+
+        if not z0 is None:
+            self._z0 = z0
+        self._changed()
+
+    def to_dict(self):
+        """
+        Returns a description of the plane as a dictionary of plain values.
+        """
+
+        return {"type": type(self).__name__, "z0": float(self._z0)}
+
     def propagate(self, ray):
         """
         Propagates a ray through the element.
         If the ray does not intercept, this method will return False, and won't update the ray.
         
         If passed an iterable, will propagate each element through the plane. Returns a set of tuples representing notable function outputs with the index of the element that produced it.
+        If passed a RayBundle, all its rays are propagated in one vectorised step.
         """
         
+        if isinstance(ray, r.RayBundle):
+            return self._propagate_bundle(ray)
+
         if isinstance(ray, Iterable):
             res = [self.propagate(r) for r in ray]
             if all([x is None for x in res]):
@@ -318,4 +866,252 @@ class OutputPlane(Element):
         if intercept is None:
             return False
         
-        ray.append(intercept, ray.dirn().copy())
+        ray.append(intercept, ray.dirn().copy(), self)
+
+    def _propagate_bundle(self, bundle):
+        """
+        Propagates a RayBundle through the plane, with the same outcomes as propagating each ray.
+        """
+
+        pos, dirn = bundle.pos().astype(float), bundle.dirn().astype(float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            l = (self._z0 - pos[:, 2]) / dirn[:, 2]
+        idx = np.flatnonzero(l >= 0)
+        bundle.append(idx, pos[idx] + l[idx, None] * dirn[idx], bundle.dirn()[idx], self)
+
+class Fibre(Element):
+    """
+    Represents a straight cylindrical fibre (or light pipe) along the z axis, with flat end faces.
+    Rays are guided along the core by total internal reflection at the core-cladding boundary.
+    Rays that land on the plane of the entry face outside the core pass the fibre unchanged, as if it were not there.
+    """
+
+    def __init__(self, z0, length, radius, n_core, n_clad, n_ext=1):
+        """
+        z0: the z position of the entry face.
+        length: the length of the fibre.
+        radius: the radius of the core.
+        n_core: refractive index of the core.
+        n_clad: refractive index of the cladding.
+        n_ext: refractive index outside both end faces.
+        All indices can be given in any of the forms accepted by SphericalRefractor.
+        """
+
+        self._z0, self._length, self._radius = z0, length, radius
+        self.__n_core, self.__n_clad, self.__n_ext = m.index(n_core), m.index(n_clad), m.index(n_ext)
+
+    def __repr__(self):
+        return "elements.Fibre({:g}, {:g}, {:g}, {}, {}, {})".format(self._z0, self._length, self._radius, self.__n_core, self.__n_clad, self.__n_ext)
+
+    def get_paraxial(self):
+        """
+        Gets a reasonable estimate for paraxial approximation: here returns 1, as the fibre does not focus.
+        """
+
+        return 1
+
+    def perturb(self, z0=0, length=0, radius=0):
+        """
+        Returns a copy of the fibre with its dimensions offset by the given amounts.
+        """
+
+        elem = copy.copy(self)
+        elem._z0 += z0
+        elem._length += length
+        elem._radius += radius
+        return elem
+
+    def set(self, z0=None, length=None, radius=None):
+        """
+        Changes the dimensions of the fibre in place, those left as None are unchanged.
+        """
+
+        if not z0 is None:
+            self._z0 = z0
+        if not length is None:
+            self._length = length
+        if not radius is None:
+            self._radius = radius
+        self._changed()
+
+    def to_dict(self):
+        """
+        Returns a description of the fibre as a dictionary of plain values.
+        """
+
+        return {"type": type(self).__name__, "z0": float(self._z0), "length": float(self._length), "radius": float(self._radius),
+                "n_core": m.spec(self.__n_core), "n_clad": m.spec(self.__n_clad), "n_ext": m.spec(self.__n_ext)}
+
+    def numerical_aperture(self, wavelength=None):
+        """
+        Returns the numerical aperture of the fibre, n_ext * sin of the largest accepted angle for meridional rays.
+        Skew rays can be accepted at larger angles, see accepts.
+        """
+
+        return np.sqrt(max(self.__n_core(wavelength)**2 - self.__n_clad(wavelength)**2, 0))
+
+    def _trace(self, pos, dirn, n_ext, n_core, n_clad):
+        """
+        Traces (N, 3) arrays of ray positions and directions through the fibre, with the indices as length N arrays.
+
+        Each ray is reflected about the core boundary in a fixed chord, so the state after k reflections is the state
+        after the first reflection rotated by k times the angle subtended by the chord, and no per-reflection loop is needed.
+
+        Returns a status for each ray (0: misses the entry face, 1: transmitted, 2: lost into the cladding,
+        3: totally internally reflected at the entry face, 4: guided to the exit face but totally internally reflected there),
+        the points and directions at entry, and the final points and directions (at the exit face, or where the ray is lost).
+        """
+
+        n = len(pos)
+        status = np.zeros(n, dtype=int)
+        entry, entry_dirn = np.zeros((n, 3)), np.zeros((n, 3))
+        final, final_dirn = np.zeros((n, 3)), np.zeros((n, 3))
+
+        #rays must travel forwards onto the entry face, within the core
+        with np.errstate(divide="ignore", invalid="ignore"):
+            l = (self._z0 - pos[:, 2]) / dirn[:, 2]
+        hit = (dirn[:, 2] > 0) & (l >= 0)
+        hit[hit] = np.sum((pos[hit, :2] + l[hit, None] * dirn[hit, :2])**2, axis=1) <= self._radius**2
+        if not np.any(hit):
+            return status, entry, entry_dirn, final, final_dirn
+
+        entry[hit] = pos[hit] + l[hit, None] * dirn[hit]
+        face = np.tile([0, 0, -1.0], (np.count_nonzero(hit), 1))
+        d, tir = k.refract_many(dirn[hit], face, n_ext[hit], n_core[hit])
+        entry_dirn[hit] = d
+        status[hit] = np.where(tir, 3, 1)
+        final[hit], final_dirn[hit] = entry[hit], d
+
+        inside = hit.copy()
+        inside[hit] = ~tir
+        p, d = entry[inside, :2], entry_dirn[inside]
+        a = self._radius
+
+        #transverse speed and unit direction, rays along the axis never reach the wall
+        st = np.linalg.norm(d[:, :2], axis=1)
+        moving = st > 0
+        u = np.zeros_like(p)
+        u[moving] = d[moving, :2] / st[moving, None]
+
+        #transverse path length over the full length of the fibre
+        s_total = np.where(moving, self._length * st / d[:, 2], 0)
+
+        #signed distance of the transverse path from the axis, and half the chord length
+        b = p[:, 0] * u[:, 1] - p[:, 1] * u[:, 0]
+        h = np.sqrt(np.maximum(a**2 - b**2, 0))
+        s_0 = -np.sum(p * u, axis=1) + h
+        chord = 2 * h
+
+        bounces = moving & (s_total > s_0) & (chord > 0)
+
+        #total internal reflection at the wall requires sin(incidence) > n_clad/n_core
+        cos_wall = st * h / a
+        guided = n_core[inside]**2 * (1 - cos_wall**2) > n_clad[inside]**2
+        lost = bounces & ~guided
+        bounces &= guided
+
+        out_xy = p + s_total[:, None] * u
+        out_dirn = d.copy()
+        if np.any(bounces):
+            p_1 = p[bounces] + s_0[bounces, None] * u[bounces]
+            normal = p_1 / a
+            u_1 = u[bounces] - 2 * np.sum(u[bounces] * normal, axis=1)[:, None] * normal
+            n_bounce = 1 + np.floor((s_total[bounces] - s_0[bounces]) / chord[bounces])
+            s_rem = s_total[bounces] - s_0[bounces] - (n_bounce - 1) * chord[bounces]
+
+            #angle subtended by each chord, in the sense of the ray's circulation
+            angle = (n_bounce - 1) * np.where(b[bounces] < 0, -1, 1) * 2 * np.arctan2(h[bounces], abs(b[bounces]))
+            c, s = np.cos(angle), np.sin(angle)
+            rotate = lambda v : np.column_stack([c * v[:, 0] - s * v[:, 1], s * v[:, 0] + c * v[:, 1]])
+            u_n = rotate(u_1)
+            out_xy[bounces] = rotate(p_1) + s_rem[:, None] * u_n
+            out_dirn[bounces, :2] = st[bounces, None] * u_n
+
+        #exit face
+        out = np.column_stack([out_xy, np.full(len(p), self._z0 + self._length)])
+        exit_dirn, tir = k.refract_many(out_dirn, np.tile([0, 0, -1.0], (len(p), 1)), n_core[inside], n_ext[inside])
+        res_pt, res_dirn, res_status = out, exit_dirn, np.where(tir, 4, 1)
+
+        #rays escaping into the cladding are stopped at the first wall hit
+        res_pt[lost, :2] = p[lost] + s_0[lost, None] * u[lost]
+        res_pt[lost, 2] = self._z0 + s_0[lost] * entry_dirn[inside][lost, 2] / st[lost]
+        res_dirn[lost] = entry_dirn[inside][lost]
+        res_status[lost] = 2
+
+        final[inside], final_dirn[inside], status[inside] = res_pt, res_dirn, res_status
+        return status, entry, entry_dirn, final, final_dirn
+
+    def _trace_rays(self, rays):
+        """
+        Traces a list of rays through the fibre in one batch, returning the outputs of _trace.
+        """
+
+        wavelengths = [x.wavelength() for x in rays]
+        n_ext, n_core, n_clad = [np.array([n(l) for l in wavelengths], dtype=float) for n in (self.__n_ext, self.__n_core, self.__n_clad)]
+        pos = np.array([x.pos() for x in rays], dtype=float).reshape(-1, 3)
+        dirn = np.array([x.dirn() for x in rays], dtype=float).reshape(-1, 3)
+        return self._trace(pos, dirn, n_ext, n_core, n_clad)
+
+    def accepts(self, ray):
+        """
+        Checks whether a ray enters the core and is guided by total internal reflection to the exit face, whether or not it
+        then leaves through the exit face.
+        If passed an iterable, returns an array with a value for each ray.
+        """
+
+        rays = list(ray) if isinstance(ray, Iterable) else [ray]
+        status, *_ = self._trace_rays(rays)
+        guided = (status == 1) | (status == 4)
+        return guided if isinstance(ray, Iterable) else guided[0]
+
+    def propagate(self, ray):
+        """
+        Propagates a ray through the fibre, adding the entry point and the exit point to its trail (reflections in the core are not recorded).
+        If the ray does not hit the entry face within the core, this method will return False, and won't update the ray.
+        If the ray escapes into the cladding, or totally internally reflects at an end face, the ray will be terminated where this happens.
+
+        If passed an iterable, all the rays are traced in one vectorised batch. Returns a set of tuples representing notable function outputs with the index of the element that produced it.
+        If passed a RayBundle, all its rays are propagated in one vectorised step.
+        """
+        if isinstance(ray, r.RayBundle):
+            return self._propagate_bundle(ray)
+
+
+        rays = list(ray) if isinstance(ray, Iterable) else [ray]
+        live = [x for x in rays if not x.terminated()]
+        res = {id(x): False for x in rays}
+
+        if live:
+            status, entry, entry_dirn, final, final_dirn = self._trace_rays(live)
+            for i, x in enumerate(live):
+                if status[i] == 0:
+                    continue
+                x.append(entry[i], entry_dirn[i], self)
+                x.append(final[i], final_dirn[i], self)
+                if status[i] >= 2:
+                    x.terminate()
+                else:
+                    res[id(x)] = None
+
+        if not isinstance(ray, Iterable):
+            return res[id(ray)]
+        res = [res[id(x)] for x in rays]
+        if all([x is None for x in res]):
+            return None
+        else:
+            return list(filter(lambda x : not x[1] is None, [(i, x) for i, x in enumerate(res)]))
+
+    def _propagate_bundle(self, bundle):
+        """
+        Propagates a RayBundle through the fibre, with the same outcomes as propagating each ray.
+        """
+
+        live = np.flatnonzero(~bundle.terminated())
+        wavelength = _subset(bundle.wavelength(), live)
+        n_ext, n_core, n_clad = [np.broadcast_to(_indices(n, wavelength), live.shape).astype(float) for n in (self.__n_ext, self.__n_core, self.__n_clad)]
+        status, entry, entry_dirn, final, final_dirn = self._trace(bundle.pos()[live].astype(float), bundle.dirn()[live].astype(float), n_ext, n_core, n_clad)
+
+        hit = status != 0
+        bundle.append(live[hit], entry[hit], entry_dirn[hit], self)
+        bundle.append(live[hit], final[hit], final_dirn[hit], self)
+        bundle.terminate(live[status >= 2])
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Off-axis field analysis: spot size, image position and best focus across field angles, from a single vectorised trace.
+"""
+
+import numpy as np
+import ray as r, elements as e, opticsutils as ou, spot as s
+
+def field_bundle(angles, bundle_radius=5e-3, n_rings=6, n_rays=6, wavelength=None, dtype=np.float64):
+    """
+    Generates one RayBundle holding a collimated bundle (as ray.bundle, in the z=0 pupil) for each field angle.
+    angles: field angles in radians, tilted in the y-z plane.
+
+    Returns the bundle, and the index of the field angle of each ray. The first ray of each field is its chief ray.
+    """
+
+    angles = np.asarray(angles, dtype=float)
+    pupil = r.ray_bundle(bundle_radius, n_rings, n_rays).pos().astype(float)
+    field = np.repeat(np.arange(len(angles)), len(pupil))
+
+    pts = np.tile(pupil, (len(angles), 1))
+    dirs = np.column_stack([np.zeros(len(field)), np.sin(angles)[field], np.cos(angles)[field]])
+    return r.RayBundle(pts, dirs, wavelength, dtype, "none"), field
+
+def _field_mean(field, v, k, count):
+    """
+    Returns the (k, 2) mean over the rays of each field of the (N, 2) array v.
+    """
+
+    return np.column_stack([np.bincount(field, weights=v[:, i], minlength=k) for i in range(2)]) / count[:, None]
+
+def analyse(sys, angles, image_z=None, bundle_radius=5e-3, n_rings=6, n_rays=6, wavelength=None):
+    """
+    Traces bundles at all the field angles through a system in one batch, and reports per-field metrics at an image plane.
+    angles: field angles in radians.
+    image_z: position of the image plane, defaults to the on-axis paraxial focus (opticsutils.get_focus).
+
+    Returns a dictionary of arrays over the fields:
+        "centroid": (x, y) centroid of the spot.
+        "chief": (x, y) position of the chief ray.
+        "rms": RMS spot radius about the centroid.
+        "distortion": fractional shift of the centroid height from the first order height, scaled by tan(angle)
+                      from the smallest non-zero field (nan for the on-axis field).
+        "best_focus": z of the least RMS spot for the field, giving the field curvature.
+        "best_rms": RMS spot radius about the centroid at best_focus.
+        "spots": the spot.SpotStats of each field, about its chief ray.
+    Output planes in the system are ignored. Rays that are terminated, or never reach the image plane, are left out,
+    and fields with no rays left have nan metrics.
+    """
+
+    angles = np.asarray(angles, dtype=float)
+    if image_z is None:
+        image_z = ou.get_focus(sys)
+        if not image_z:
+            raise ValueError("System does not focus, give image_z explicitly.")
+
+    #output planes would stop the rays before the image plane, the final segments are extended to it instead
+    bundle, field = field_bundle(angles, bundle_radius, n_rings, n_rays, wavelength)
+    e.System([x for x in sys.elements() if not isinstance(x, e.OutputPlane)]).propagate(bundle)
+
+    image, live = ou.plane_xy(bundle, image_z)
+
+    field_live = field[live]
+    xy = image[live]
+    dirn = bundle.dirn()[live].astype(float)
+    #transverse change per unit z beyond the image plane
+    slope = dirn[:, :2] / dirn[:, 2:]
+
+    k = len(angles)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        count = np.bincount(field_live, minlength=k).astype(float)
+        centroid = _field_mean(field_live, xy, k, count)
+        a = xy - centroid[field_live]
+        b = slope - _field_mean(field_live, slope, k, count)[field_live]
+
+        #the RMS spot at z = image_z + dz is quadratic in dz, minimised at dz = -<a.b>/<b.b>
+        ab = np.bincount(field_live, weights=np.sum(a * b, axis=1), minlength=k)
+        bb = np.bincount(field_live, weights=np.sum(b * b, axis=1), minlength=k)
+        aa = np.bincount(field_live, weights=np.sum(a * a, axis=1), minlength=k)
+        dz = np.where(bb > 0, -ab / bb, 0)
+        rms = np.sqrt(aa / count)
+        best_rms = np.sqrt(np.maximum(aa + 2 * dz * ab + dz**2 * bb, 0) / count)
+
+        #first order image height from the smallest non-zero field
+        nonzero = np.flatnonzero(angles != 0)
+        distortion = np.full(k, np.nan)
+        if len(nonzero):
+            ref = nonzero[np.argmin(abs(angles[nonzero]))]
+            scale = centroid[ref, 1] / np.tan(angles[ref])
+            distortion[nonzero] = centroid[nonzero, 1] / (scale * np.tan(angles[nonzero])) - 1
+
+    chief_idx = np.arange(k) * (len(field) // k)
+    chief = image[chief_idx]
+
+    spots = []
+    for i in range(k):
+        pts = xy[field_live == i]
+        reference = centroid[i] if np.any(np.isnan(chief[i])) else chief[i]
+        r_max = np.sqrt(np.max(np.sum((pts - reference)**2, axis=1))) if len(pts) else 0
+        stats = s.SpotStats(r_max * 1.001 if r_max > 0 else 1e-9, reference=np.nan_to_num(reference))
+        stats.add(pts)
+        spots.append(stats)
+
+    return {"angles": angles, "image_z": image_z, "centroid": centroid, "chief": chief, "rms": rms, "distortion": distortion,
+            "best_focus": image_z + dz, "best_rms": best_rms, "spots": spots}
@@ -4,9 +4,11 @@ Graphics utility functions.
 
 A bug in some versions of matplotlib will prevent these functions generating useful output for small values.
 Update matplotlib to fix -- please see https://github.com/matplotlib/matplotlib/issues/6015.
+
+matplotlib is imported when a graph is first drawn, not with the module.
 """
 
-import matplotlib.pyplot as plt, numpy as np
+import numpy as np
 import opticsutils as ou, elements as e
 
 MPL_BUGFIX_SCALE = 1.1
@@ -15,6 +17,7 @@ def graph_zplane(rays, z):
     """
     Graphs a set of rays at a given z plane.
     """
+    import matplotlib.pyplot as plt
 
     #a list of x,y values with those rays that don't pass z omitted
     xy = list(filter(lambda y : not y is None, [x.get_xy(z) for x in rays]))
@@ -36,6 +39,7 @@ def graph_yplane(rays):
     """
     Graphs a set of rays as a y-z plane.
     """
+    import matplotlib.pyplot as plt
 
     fig, ax = plt.subplots()
     for ray in rays:
@@ -48,6 +52,7 @@ def graph_spot_size(range, step, focus, z1, z2, n1, n2):
 
     range: should be a tuple (start, end).
     """
+    import matplotlib.pyplot as plt
     c1 = np.arange(*range, step=step)
     size = []
     for i, c in enumerate(c1):
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+An asyncio interface for running many lens evaluations on a pool of worker processes.
+
+Systems are sent to the workers as their descriptions (see elements.System.to_dict), so they must only use index objects
+from the materials module.
+"""
+
+import asyncio, json, time
+from concurrent.futures import ProcessPoolExecutor
+import elements as e
+
+KINDS = ("focus", "spot_size", "c2", "optimize")
+
+def _run(kind, system, kwargs):
+    """
+    Runs a single evaluation in a worker process, returning (value, seconds taken).
+    """
+
+    import opticsutils as ou, optimizer as ot
+
+    start = time.perf_counter()
+    if not system is None:
+        system = e.from_dict(system)
+
+    if kind == "focus":
+        value = ou.get_focus(system, **kwargs)
+    elif kind == "spot_size":
+        value = ou.spot_size(system, **kwargs)
+    elif kind == "c2":
+        value = ou.get_c2(**kwargs)
+    else:
+        value = ot.optimize(**kwargs)
+
+    return value, time.perf_counter() - start
+
+class JobResult:
+    """
+    The result of a job, with its timing.
+    """
+
+    def __init__(self, kind, value, run_time, wait_time, deduplicated):
+        """
+        run_time: seconds spent evaluating in the worker.
+        wait_time: seconds from submission to the result being available (including queueing).
+        deduplicated: True if the job shared the evaluation of an identical job already in flight.
+        """
+
+        self.kind, self.value, self.run_time, self.wait_time, self.deduplicated = kind, value, run_time, wait_time, deduplicated
+
+    def __repr__(self):
+        return "jobs.JobResult {{kind: {}, value: {}, run_time: {:g}, wait_time: {:g}, deduplicated: {}}}".format(self.kind, self.value, self.run_time, self.wait_time, self.deduplicated)
+
+class JobRunner:
+    """
+    Submits evaluations to a bounded pool of worker processes, and returns them as awaitables.
+
+    Identical jobs (same kind, system fingerprint and arguments) submitted while one is in flight share its evaluation.
+    Use as an async context manager, or call close when finished.
+    """
+
+    def __init__(self, max_workers=None):
+        """
+        max_workers: the number of worker processes, defaults to the number of CPUs.
+        """
+
+        self.__pool = ProcessPoolExecutor(max_workers)
+        #evaluations in flight, and the number of jobs waiting on each
+        self.__inflight, self.__waiters = {}, {}
+
+    def __repr__(self):
+        return "jobs.JobRunner {{in flight: {}}}".format(len(self.__inflight))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        Shuts down the worker pool, cancelling evaluations that have not started.
+        """
+
+        self.__pool.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, kind, system=None, timeout=None, **kwargs):
+        """
+        Submits a job, must be called from within a running event loop. Returns an asyncio task resolving to a JobResult.
+
+        kind: "focus" or "spot_size" (opticsutils functions of system), "c2" (opticsutils.get_c2) or "optimize" (optimizer.optimize).
+        system: the System to evaluate, for focus and spot_size.
+        timeout: seconds to wait before raising asyncio.TimeoutError.
+        kwargs: further arguments of the function evaluated.
+
+        Cancelling the task (or a timeout) cancels the evaluation once no other job is waiting on it.
+        Evaluations that have already started in a worker run to completion, but their results are discarded.
+        """
+
+        if not kind in KINDS:
+            raise ValueError("Unknown job kind: {}.".format(kind))
+
+        spec = None if system is None else system.to_dict()
+        key = (kind, None if system is None else system.fingerprint(), json.dumps(kwargs, sort_keys=True, default=float))
+
+        shared = self.__inflight.get(key)
+        deduplicated = not shared is None
+        if shared is None:
+            shared = asyncio.wrap_future(self.__pool.submit(_run, kind, spec, kwargs))
+            self.__inflight[key], self.__waiters[key] = shared, 0
+            shared.add_done_callback(lambda f : self.__forget(key, f))
+        self.__waiters[key] += 1
+
+        return asyncio.ensure_future(self.__wait(kind, key, shared, timeout, deduplicated, time.perf_counter()))
+
+    def __forget(self, key, shared):
+        if self.__inflight.get(key) is shared:
+            del self.__inflight[key], self.__waiters[key]
+
+    async def __wait(self, kind, key, shared, timeout, deduplicated, start):
+        try:
+            value, run_time = await asyncio.wait_for(asyncio.shield(shared), timeout)
+        finally:
+            if self.__inflight.get(key) is shared:
+                self.__waiters[key] -= 1
+                if self.__waiters[key] == 0 and not shared.done():
+                    shared.cancel()
+        return JobResult(kind, value, run_time, time.perf_counter() - start, deduplicated)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Refraction and reflection kernels used by the tracer.
+
+This module only depends on numpy, so that the core tracer (ray, elements) can be imported without scipy or matplotlib.
+"""
+
+import numpy as np
+
+visible_lims = (380e-9, 740e-9)
+
+#single precision rays with the cosine of either angle below this (near-grazing, near-critical or TIR) are refracted again in double precision
+GRAZING_COS = 0.1
+
+def refract(incident, surface, n1, n2):
+    """
+    Refracts a ray according to Snell's law, both incident and surface should be normalised vectors.
+    """
+
+    #get angle of incidence
+    the_1 = np.arccos(np.dot(-incident, surface))
+
+    if np.sin(the_1) > (n2/n1):
+        #TIR
+        return reflect(incident, surface)
+    
+    #calc angle of refraction
+    the_2 = np.arcsin((n1/n2) * np.sin(the_1))
+    
+    if the_2 == 0:
+        return -surface
+    
+    #find refracted ray in plane - this uses the fact that the refracted ray will be a linear combination of the surface and incident rays
+    b = abs(np.sin(the_2)/np.sin(the_1))
+    a = b * np.cos(the_1) - np.cos(the_2)
+    refracted = a * surface + b * incident
+    
+    return refracted
+
+def reflect(incident, surface):
+    """
+    Reflects a ray, both incident and surface should be normalised vectors.
+    """
+
+    #get angle of incidence
+    the = np.arccos(np.dot(-incident, surface))
+
+    reflected = incident + np.sqrt(2 * (1 - np.cos(np.pi - 2 * the))) * surface
+
+    return reflected
+
+def refract_many(incident, surface, n1, n2):
+    """
+    Refracts an (N, 3) array of rays according to Snell's law, both incident and surface should be arrays of normalised vectors.
+    The surface normals should face against the incident rays. n1, n2 can be constants or length N arrays.
+    The calculation is done at the precision of incident, except for near-grazing and near-critical rays, which are always done in double precision.
+
+    Returns the refracted directions, and a mask of the rays that totally internally reflect - these are reflected instead.
+    """
+
+    cos_1 = -np.sum(incident * surface, axis=1)
+    n_ratio = np.broadcast_to(np.asarray(n1, dtype=float) / n2, cos_1.shape)
+    ratio = n_ratio.astype(incident.dtype)
+
+    #squared sine of the angle of refraction, TIR where this exceeds 1
+    sin2_2 = ratio**2 * (1 - cos_1**2)
+    tir = sin2_2 > 1
+    cos_2 = np.sqrt(np.maximum(1 - sin2_2, 0))
+
+    refracted = ratio[:, None] * incident + (ratio * cos_1 - cos_2)[:, None] * surface
+    refracted[tir] = reflect_many(incident[tir], surface[tir])
+
+    if incident.dtype != np.float64:
+        grazing = (cos_1 < GRAZING_COS) | (cos_2 < GRAZING_COS)
+        if np.any(grazing):
+            refracted[grazing], tir[grazing] = refract_many(incident[grazing].astype(float), surface[grazing].astype(float), n_ratio[grazing], 1)
+
+    return refracted, tir
+
+def reflect_many(incident, surface):
+    """
+    Reflects an (N, 3) array of rays, both incident and surface should be arrays of normalised vectors.
+    """
+
+    return incident - 2 * np.sum(incident * surface, axis=1)[:, None] * surface
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Refractive index descriptions.
+
+Unlike lambdas, these can be pickled (e.g. sent to worker processes) and written to and read from plain dictionaries.
+"""
+
+import numpy as np, os.path as osp
+
+class ConstantIndex:
+    """
+    A refractive index that does not depend on wavelength.
+    """
+
+    def __init__(self, n):
+        self.n = float(n)
+
+    def __repr__(self):
+        return "materials.ConstantIndex({:g})".format(self.n)
+
+    def __call__(self, wavelength):
+        return self.n
+
+    def spec(self):
+        return self.n
+
+class LinearIndex:
+    """
+    A refractive index varying linearly with wavelength, n + slope * (wavelength - wavelength0).
+    """
+
+    def __init__(self, n, wavelength, slope):
+        """
+        n: the index at wavelength.
+        slope: the change in index per unit wavelength.
+        For wavelength None, the index n is returned.
+        """
+
+        self.n, self.wavelength, self.slope = float(n), float(wavelength), float(slope)
+
+    def __repr__(self):
+        return "materials.LinearIndex({:g}, {:g}, {:g})".format(self.n, self.wavelength, self.slope)
+
+    def __call__(self, wavelength):
+        if wavelength is None:
+            return self.n
+        return self.n + self.slope * (wavelength - self.wavelength)
+
+    def spec(self):
+        return {"type": "linear", "n": self.n, "wavelength": self.wavelength, "slope": self.slope}
+
+class TableIndex:
+    """
+    A refractive index interpolated from a table of wavelength,index pairs in a CSV, as for opticsutils.load_index.
+    """
+
+    def __init__(self, path, name=None):
+        """
+        path: path of the CSV, relative to this module.
+        name: the material name, if loaded with material.
+        """
+
+        self.path, self.name = path, name
+        table = np.loadtxt(osp.join(osp.abspath(osp.dirname(__file__)), path), delimiter=',', ndmin=2)
+        order = np.argsort(table[:, 0])
+        self.__wavelengths, self.__indices = table[order, 0], table[order, 1]
+
+    def __repr__(self):
+        if not self.name is None:
+            return "materials.material(\"{}\")".format(self.name)
+        return "materials.TableIndex(\"{}\")".format(self.path)
+
+    def __call__(self, wavelength):
+        if wavelength is None or wavelength < self.__wavelengths[0] or wavelength > self.__wavelengths[-1]:
+            raise ValueError("No value for given wavelength in the range of the table.")
+        return np.interp(wavelength, self.__wavelengths, self.__indices)
+
+    def spec(self):
+        if not self.name is None:
+            return self.name
+        return {"type": "table", "path": self.path}
+
+class OffsetIndex:
+    """
+    Another refractive index, offset by a constant amount at every wavelength.
+    """
+
+    def __init__(self, index, offset):
+        self.index, self.offset = index, float(offset)
+
+    def __repr__(self):
+        return "materials.OffsetIndex({}, {:g})".format(self.index, self.offset)
+
+    def __call__(self, wavelength):
+        return self.index(wavelength) + self.offset
+
+    def spec(self):
+        return {"type": "offset", "index": spec(self.index), "offset": self.offset}
+
+def material(name):
+    """
+    Returns the index of a named material, tabulated in data/<name>.csv.
+    """
+
+    return TableIndex(osp.join("data", name + ".csv"), name)
+
+def index(n):
+    """
+    Converts a description of a refractive index to an index object:
+    a number (constant index), a material name, a dictionary as produced by spec, or a callable, which is returned unchanged.
+    """
+
+    if callable(n):
+        return n
+    if isinstance(n, str):
+        return material(n)
+    if isinstance(n, dict):
+        if n["type"] == "linear":
+            return LinearIndex(n["n"], n["wavelength"], n["slope"])
+        if n["type"] == "table":
+            return TableIndex(n["path"])
+        if n["type"] == "offset":
+            return OffsetIndex(index(n["index"]), n["offset"])
+        raise ValueError("Unknown index type: {}.".format(n["type"]))
+    return ConstantIndex(n)
+
+def spec(n):
+    """
+    Returns the description of an index object, for use with index.
+    Raises a ValueError for arbitrary functions, which can not be described.
+    """
+
+    if not hasattr(n, "spec"):
+        raise ValueError("Index {} can not be described, use an index object from the materials module instead.".format(n))
+    return n.spec()
@@ -3,79 +3,50 @@
 General purpose utility functions for optics.
 """
 
-import numpy as np, scipy.optimize as op, os.path as osp
+import numpy as np, os.path as osp
 import ray as r, elements as e
+#kept importable from here for existing scripts
+from kernels import visible_lims, refract, reflect
 
-visible_lims = (380e-9, 740e-9)
-
-def refract(incident, surface, n1, n2):
+def __axis_crossing(pos, dirn, terminated, allow_virtual):
     """
-    Refracts a ray according to Snell's law, both incident and surface should be normalised vectors.
+    Utility method finding where a probe's final segment meets the axis, or False if it does not converge.
     """
 
-    #get angle of incidence
-    the_1 = np.arccos(np.dot(-incident, surface))
+    if terminated:
+        return False
 
-    if np.sin(the_1) > (n2/n1):
-        #TIR
-        return reflect(incident, surface)
-    
-    #calc angle of refraction
-    the_2 = np.arcsin((n1/n2) * np.sin(the_1))
-    
-    if the_2 == 0:
-        return -surface
+    #return False if the probe runs parallel to the axis
+    if dirn[1] == 0:
+        return False
     
-    #find refracted ray in plane - this uses the fact that the refracted ray will be a linear combination of the surface and incident rays
-    b = abs(np.sin(the_2)/np.sin(the_1))
-    a = b * np.cos(the_1) - np.cos(the_2)
-    refracted = a * surface + b * incident
+    #distance along the final segment to the axis
+    l = -pos[1] / dirn[1]
+    if l < 0 and not allow_virtual:
+        return False
     
-    return refracted
-
-def reflect(incident, surface):
-    """
-    Reflects a ray, both incident and surface should be normalised vectors.
-    """
+    return pos[2] + l * dirn[2]
 
-    #get angle of incidence
-    the = np.arccos(np.dot(-incident, surface))
-
-    reflected = incident + np.sqrt(2 * (1 - np.cos(np.pi - 2 * the))) * surface
-
-    return reflected
-
-def get_focus(sys, paraxial_precision=None, output_step=250e-3):
+def get_focus(sys, paraxial_precision=None, output_step=None, allow_virtual=False):
     """
     Uses a probe ray to estimate the focal point of an optical system.
     paraxial_precision: the y-height of the probe ray.
-    output_step: best not to change, effects the way the function iterates, try raising if not producing output.
+    output_step: no longer has any effect, the focus is found without stepping output planes. Kept for existing callers.
+    allow_virtual: if True, returns the z-value of a virtual focus (where the extended final ray meets the axis behind its last vertex).
     
-    Returns the z-value of the paraxial focus, or false if the system does not converge.
+    The probe's final segment is a straight line, so its intersection with the axis is found directly.
+    Returns the z-value of the paraxial focus, or False if the system does not converge (the probe diverges, runs parallel to the axis, or is terminated).
     """
     if paraxial_precision is None:
         paraxial_precision = sys.get_paraxial()
     
-    probe = r.Ray([0, paraxial_precision, 0], [0,0,1])
-    sys.propagate(probe)
+    probe = r.Ray([0, paraxial_precision, 0], [0,0,1], record="none")
+    #output planes don't change direction, but would move the last vertex past the focus
+    for elem in sys.elements():
+        if not isinstance(elem, e.OutputPlane):
+            elem.propagate(probe)
     
-    #return False if lens doesn't focus
-    e.OutputPlane(output_step).propagate(probe)
-    if probe.vertices()[-1][1] >= probe.vertices()[-2][1]:
-        return False
-
-    #this progressively increases the output plane until the probe ray falls through the z-axis.
-    i = 2
-    while probe.pos()[1] > 0:
-        output = e.OutputPlane(i * output_step * probe.dirn()[2]/abs(probe.dirn()[2]))
-        output.propagate(probe)
-        i += 1
-    
-    #assuming linear ray propagation, interpolates z position
-    vertices = probe.vertices()
-    ratio = abs(vertices[-2][1]/(vertices[-2][1] - vertices[-1][1]))
-    
-    return (vertices[-1][2] - vertices[-2][2]) * ratio + vertices[-2][2]
+    return __axis_crossing(probe.pos(), probe.dirn(), probe.terminated(), allow_virtual)
     
 def spot_size(sys, focus=None, bundle_radius=5e-3):
     """
@@ -83,8 +54,9 @@ def spot_size(sys, focus=None, bundle_radius=5e-3):
     focus: defaults to None, if None will use opticsutils.get_focus to find.
     bundle_radius: the radius of the bundle used for estimation.
     
-    If this method hangs, it is likely due to opticsutils.get_focus - call it explicitly as a kwarg to adjust running parameters or input a focus manually.
-    Returns false if the system does not converge.
+    Output planes in the system are ignored, and each ray's final segment is extended to the focal plane.
+    Rays that are terminated, or that never reach the focal plane along their final segment, are left out.
+    Returns false if the system does not converge, or no rays reach the focal plane.
     """
     
     if focus is None:
@@ -92,15 +64,60 @@ def spot_size(sys, focus=None, bundle_radius=5e-3):
         if not focus:
             return False
         
-    bundle = r.bundle(bundle_radius, 6, 6)
-    #coefficient because sometimes focus is truncated between here and get_xy, and the focal point lies past the output plane
-    sys.append(e.OutputPlane(focus * 1.1))
+    #only the final segments are needed, and output planes would stop the rays before the focal plane
+    bundle = r.bundle(bundle_radius, 6, 6, record="none")
+    sys = e.System([x for x in sys.elements() if not isinstance(x, e.OutputPlane)])
     
     sys.propagate(bundle)
     
-    spots = [np.linalg.norm(r.get_xy(focus))**2 for r in bundle]
-    
-    return np.sqrt(np.average(spots))
+    return __rms(*plane_xy(r.from_rays(bundle, record="none"), focus))
+
+def plane_xy(bundle, z):
+    """
+    Extends the final segments of the rays in a RayBundle to the plane at z.
+    Returns an (N, 2) array of their x, y positions there, and a mask of the rays that reach it.
+    Rays that are terminated, or that never reach the plane along their final segment, are left out (their positions are nan).
+    """
+
+    pos, dirn = bundle.pos().astype(float), bundle.dirn().astype(float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        l = (z - pos[:, 2]) / dirn[:, 2]
+    reached = ~bundle.terminated() & np.isfinite(l) & (l >= 0)
+
+    xy = np.full((len(pos), 2), np.nan)
+    xy[reached] = pos[reached, :2] + l[reached, None] * dirn[reached, :2]
+    return xy, reached
+
+def __rms(xy, reached):
+    """
+    Utility method returning the RMS radius of the positions that reached a plane, or False if none did.
+    """
+
+    if not np.any(reached):
+        return False
+    return np.sqrt(np.average(np.sum(xy[reached]**2, axis=1)))
+
+def focus_spot(sys, focus=None, bundle_radius=5e-3, dtype=np.float64):
+    """
+    Finds the focus and RMS spot size of a system as get_focus and spot_size do, with the probe and the bundle traced together
+    as one RayBundle.
+    focus: if given, only the spot size at this focus is found.
+    dtype: the precision of the RayBundle.
+
+    Returns (focus, spot size), with False for those that are not found.
+    """
+
+    pupil = r.ray_bundle(bundle_radius, 6, 6).pos()
+    bundle = r.RayBundle(np.vstack([[0, sys.get_paraxial(), 0], pupil]), np.tile([0, 0, 1.0], (len(pupil) + 1, 1)), dtype=dtype, record="none")
+    e.System([x for x in sys.elements() if not isinstance(x, e.OutputPlane)]).propagate(bundle)
+
+    if focus is None:
+        focus = __axis_crossing(bundle.pos()[0].astype(float), bundle.dirn()[0].astype(float), bundle.terminated()[0], False)
+        if not focus:
+            return (False, False)
+
+    xy, reached = plane_xy(bundle, focus)
+    return (focus, __rms(xy[1:], reached[1:]))
             
 def get_c2(c1, focus, z1=100e-3, z2=105e-3, n1=1, n2=1.5168):
     """
@@ -113,6 +130,8 @@ def get_c2(c1, focus, z1=100e-3, z2=105e-3, n1=1, n2=1.5168):
     n1: refractive index of the environment.
     n2: refractive index of the lens.
     """
+    #scipy is only needed here, so is not imported with the module
+    import scipy.optimize as op
     try:
         #guess from the lens maker's formula
         guess = c1 - ((focus - z1) * (n2 - n1))**-1
@@ -4,13 +4,14 @@ Contains the ray class.
 """
 
 import numpy as np, copy
-import opticsutils as ou
+import kernels as k
 
-def bundle(r, n_rings, n_rays, wavelength=None):
+def bundle(r, n_rings, n_rays, wavelength=None, record="full"):
     """
     Generates a bundle of rays of radius r.
     n_rings is the number of concentric rings to build the bundle of (incuding the central ray).
     n_rays is the number of rays to be equally spaced about the first ring.
+    record: the trail recording mode of each ray, see Ray.
     """
 
     rays = []
@@ -20,7 +21,7 @@ def bundle(r, n_rings, n_rays, wavelength=None):
     for i in range(n_rings + 1):
         if i == 0:
             #if central ray
-            rays.append(Ray([0, 0, 0], [0, 0, 1], wavelength))
+            rays.append(Ray([0, 0, 0], [0, 0, 1], wavelength, record))
         else:
             #walk around circle
             the_step = 2 * np.pi / (n_rays * i)
@@ -28,7 +29,7 @@ def bundle(r, n_rings, n_rays, wavelength=None):
                 #calculated final values
                 r_n = r_step * i
                 the_n = the_step * j
-                rays.append(Ray([r_n * np.cos(the_n), r_n * np.sin(the_n), 0], [0, 0, 1], wavelength))
+                rays.append(Ray([r_n * np.cos(the_n), r_n * np.sin(the_n), 0], [0, 0, 1], wavelength, record))
     return rays
 
 class Ray:
@@ -36,15 +37,29 @@ class Ray:
     Describes an optical ray with a trail of positions and directions.
     """
 
-    def __init__(self, init_pt, init_dir, wavelength=None):
+    def __init__(self, init_pt, init_dir, wavelength=None, record="full"):
+        """
+        record: which states are kept in the trail, one of
+            "full": every point-direction pair (default).
+            "final": only the most recent pair.
+            "none": nothing, only the current position and direction are kept.
+            a list of elements: the initial pair, and those appended by the listed elements.
+        """
+
         init_pt, init_dir = np.array(init_pt), np.array(init_dir)
+        if isinstance(record, str) and not record in ("full", "final", "none"):
+            raise ValueError("Unknown record mode: {}.".format(record))
         self.__wavelength = wavelength
-        self.__pts = [init_pt]
+        self.__record = record
         if np.linalg.norm(init_dir) != 0:
             #normalise direction (essentially for easy testing)
-            self.__dirs = [init_dir / np.linalg.norm(init_dir)]
+            self.__pos, self.__dir = init_pt, init_dir / np.linalg.norm(init_dir)
         else:
             raise Exception("Ray can not have no direction.")
+        if record == "none":
+            self.__pts, self.__dirs = [], []
+        else:
+            self.__pts, self.__dirs = [self.__pos], [self.__dir]
         self.__terminated = False
     
     def __repr__(self):
@@ -55,17 +70,17 @@ class Ray:
         
     def pos(self):
         """
-        Returns the current (most recently added) point in the trail.
+        Returns the current (most recently added) point.
         """
 
-        return self.__pts[-1]
+        return self.__pos
     
     def dirn(self):
         """
-        Returns the current (most recently added) direction in the trail.
+        Returns the current (most recently added) direction.
         """
 
-        return self.__dirs[-1]
+        return self.__dir
     
     def terminate(self):
         self.__terminated = True
@@ -80,18 +95,23 @@ class Ray:
 
         return self.__wavelength
 
-    def append(self, next_pt, next_dir):
+    def append(self, next_pt, next_dir, element=None):
         """
-        Appends a new point-direction pair to the trail.
+        Appends a new point-direction pair, this is recorded in the trail according to the ray's record mode.
+        element: the element producing the pair, used when recording selected elements only.
         """
 
-        self.__pts.append(next_pt)
         #again normalise direction
-        self.__dirs.append(next_dir / np.linalg.norm(next_dir))
+        self.__pos, self.__dir = next_pt, next_dir / np.linalg.norm(next_dir)
+        if self.__record == "full" or (not isinstance(self.__record, str) and element in self.__record):
+            self.__pts.append(self.__pos)
+            self.__dirs.append(self.__dir)
+        elif self.__record == "final":
+            self.__pts, self.__dirs = [self.__pos], [self.__dir]
     
     def vertices(self):
         """
-        Returns the full trail (no directions).
+        Returns the recorded trail (no directions).
         """
 
         return self.__pts
@@ -100,12 +120,15 @@ class Ray:
         r = Ray(np.array([0,0,0]), np.array([0,0,1]))
         r.__pts = copy.deepcopy(self.__pts)
         r.__dirs = copy.deepcopy(self.__dirs)
+        r.__pos, r.__dir = self.__pos.copy(), self.__dir.copy()
         r.__wavelength = self.__wavelength
+        r.__record = self.__record
         return r
     
     def get_xy(self, z):
         """
         Returns the x,y values for a given z, returns None if the ray does not exist at that z.
+        Only the recorded trail is searched.
         If the ray is multi-valued at this z, returns the chronologically earlier point.
         """
 
@@ -142,10 +165,184 @@ class Ray:
             return (0, 0, 0)
 
         #black if outside visible spectrum
-        if self.__wavelength < ou.visible_lims[0] or self.__wavelength > ou.visible_lims[1]:
+        if self.__wavelength < k.visible_lims[0] or self.__wavelength > k.visible_lims[1]:
             return (0, 0, 0)
 
-        blue = lambda x : gauss(x, 1, s, ou.visible_lims[0])
-        green = lambda x : gauss(x, 1, s, (ou.visible_lims[0] + ou.visible_lims[1]) / 2)
-        red = lambda x : gauss(x, 1, s, ou.visible_lims[1])
+        blue = lambda x : gauss(x, 1, s, k.visible_lims[0])
+        green = lambda x : gauss(x, 1, s, (k.visible_lims[0] + k.visible_lims[1]) / 2)
+        red = lambda x : gauss(x, 1, s, k.visible_lims[1])
         return [red(self.__wavelength), green(self.__wavelength), blue(self.__wavelength)]
+
+def ray_bundle(r, n_rings, n_rays, wavelength=None, dtype=np.float64, record="full"):
+    """
+    Generates the same bundle of rays as bundle, as a RayBundle for vectorised tracing.
+    dtype, record: see RayBundle.
+    """
+
+    pts = [[0, 0, 0]]
+    r_step = r / n_rings
+    for i in range(1, n_rings + 1):
+        the_n = 2 * np.pi / (n_rays * i) * np.arange(n_rays * i)
+        pts += list(np.column_stack([r_step * i * np.cos(the_n), r_step * i * np.sin(the_n), np.zeros(n_rays * i)]))
+    pts = np.array(pts, dtype=float)
+    return RayBundle(pts, np.tile([0, 0, 1.0], (len(pts), 1)), wavelength, dtype, record)
+
+def from_rays(rays, dtype=np.float64, record="full"):
+    """
+    Builds a RayBundle from the current states of a list of rays (their trails are not copied).
+    """
+
+    wavelengths = [x.wavelength() for x in rays]
+    wavelength = None if all([x is None for x in wavelengths]) else np.array([np.nan if x is None else x for x in wavelengths])
+    bundle = RayBundle([x.pos() for x in rays], [x.dirn() for x in rays], wavelength, dtype, record)
+    bundle.terminate(np.array([x.terminated() for x in rays], dtype=bool))
+    return bundle
+
+class RayBundle:
+    """
+    Describes a set of optical rays as arrays, for vectorised tracing.
+
+    Positions and directions are stored at the chosen precision, elements work in double precision where it is needed
+    (intercepts, and refraction close to grazing or critical angles) and store the results back at the bundle's precision.
+    """
+
+    def __init__(self, pts, dirs, wavelength=None, dtype=np.float64, record="full"):
+        """
+        pts, dirs: (N, 3) arrays of initial positions and directions.
+        wavelength: None, a single wavelength, or a length N array.
+        dtype: the precision of the stored positions and directions, np.float64 or np.float32.
+        record: which states are kept, as for Ray.
+        """
+
+        if isinstance(record, str) and not record in ("full", "final", "none"):
+            raise ValueError("Unknown record mode: {}.".format(record))
+        dirs = np.array(dirs, dtype=float).reshape(-1, 3)
+        norms = np.linalg.norm(dirs, axis=1)
+        if np.any(norms == 0):
+            raise Exception("Ray can not have no direction.")
+
+        self.__dtype = np.dtype(dtype)
+        self.__pos = np.array(pts, dtype=float).reshape(-1, 3).astype(self.__dtype)
+        self.__dir = (dirs / norms[:, None]).astype(self.__dtype)
+        if wavelength is None or np.ndim(wavelength) == 0:
+            self.__wavelength = wavelength
+        else:
+            self.__wavelength = np.array(wavelength, dtype=float)
+        self.__terminated = np.zeros(len(self.__pos), dtype=bool)
+        self.__record = record
+        #initial state, only needed to rebuild trails
+        self.__init = None if record in ("final", "none") else (self.__pos.copy(), self.__dir.copy())
+        #trail of (indices, points, directions) for each recorded update
+        self.__trail = []
+
+    def __repr__(self):
+        return "ray.RayBundle {{rays: {}, dtype: {}, terminated: {}}}".format(len(self), self.__dtype, np.count_nonzero(self.__terminated))
+
+    def __len__(self):
+        return len(self.__pos)
+
+    def dtype(self):
+        """
+        Returns the precision of the stored positions and directions.
+        """
+
+        return self.__dtype
+
+    def record(self):
+        """
+        Returns the record mode of the bundle.
+        """
+
+        return self.__record
+
+    def pos(self):
+        """
+        Returns the current positions of all rays, as an (N, 3) array.
+        """
+
+        return self.__pos
+
+    def dirn(self):
+        """
+        Returns the current directions of all rays, as an (N, 3) array.
+        """
+
+        return self.__dir
+
+    def wavelength(self):
+        """
+        Returns the wavelengths of the rays: None, a single value, or an array.
+        """
+
+        return self.__wavelength
+
+    def terminate(self, mask):
+        """
+        Terminates the rays selected by a boolean mask or array of indices.
+        """
+
+        self.__terminated[mask] = True
+
+    def terminated(self):
+        """
+        Returns a boolean array of the terminated rays.
+        """
+
+        return self.__terminated
+
+    def append(self, idx, next_pts, next_dirs, element=None):
+        """
+        Updates the rays at (sorted) indices idx with new point-direction pairs, recorded according to the bundle's record mode.
+        element: the element producing the pairs, used when recording selected elements only.
+        """
+
+        next_dirs = next_dirs / np.linalg.norm(next_dirs, axis=1)[:, None]
+        self.__pos[idx] = next_pts
+        self.__dir[idx] = next_dirs
+        if self.__record == "full" or (not isinstance(self.__record, str) and element in self.__record):
+            self.__trail.append((np.array(idx), self.__pos[idx], self.__dir[idx]))
+
+    def vertices(self, i):
+        """
+        Returns the recorded trail of ray i (no directions).
+        """
+
+        if self.__record == "none":
+            return []
+        if self.__record == "final":
+            return [self.__pos[i]]
+        pts = [self.__init[0][i]]
+        for idx, next_pts, next_dirs in self.__trail:
+            j = np.searchsorted(idx, i)
+            if j < len(idx) and idx[j] == i:
+                pts.append(next_pts[j])
+        return pts
+
+    def copy(self):
+        #the state is already validated, so the constructor is skipped
+        b = RayBundle.__new__(RayBundle)
+        b.__dtype, b.__wavelength, b.__record, b.__init = self.__dtype, self.__wavelength, self.__record, self.__init
+        b.__pos, b.__dir, b.__terminated = self.__pos.copy(), self.__dir.copy(), self.__terminated.copy()
+        b.__trail = list(self.__trail)
+        return b
+
+    def to_rays(self):
+        """
+        Returns the bundle as a list of Ray objects, with their recorded trails (in double precision).
+        """
+
+        rays = []
+        for i in range(len(self)):
+            wavelength = self.__wavelength if self.__wavelength is None or np.ndim(self.__wavelength) == 0 else self.__wavelength[i]
+            if self.__record in ("final", "none"):
+                x = Ray(self.__pos[i].astype(float), self.__dir[i].astype(float), wavelength, self.__record)
+            else:
+                x = Ray(self.__init[0][i].astype(float), self.__init[1][i].astype(float), wavelength)
+                for idx, next_pts, next_dirs in self.__trail:
+                    j = np.searchsorted(idx, i)
+                    if j < len(idx) and idx[j] == i:
+                        x.append(next_pts[j].astype(float), next_dirs[j].astype(float))
+            if self.__terminated[i]:
+                x.terminate()
+            rays.append(x)
+        return rays
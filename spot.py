@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Spot diagram statistics at an image plane.
+
+Statistics are accumulated from moments and fixed-grid histograms, so results from separate chunks of rays
+(or separate processes) can be merged and give the same result as one pass over all the rays.
+"""
+
+import numpy as np
+import ray as r
+
+class SpotStats:
+    """
+    Mergeable statistics of the (x, y) positions of a set of rays.
+    """
+
+    def __init__(self, max_radius, bins=64, radial_bins=1024, reference=(0, 0)):
+        """
+        max_radius: half-width of the spot histogram, and the largest radius (from reference) that encircled energy is resolved to.
+        bins: number of histogram bins along each of x, y.
+        radial_bins: number of bins used for the encircled energy, which is resolved to max_radius / radial_bins.
+        reference: the point radii are measured from, usually the axis or the chief ray.
+
+        Only statistics with the same max_radius, bins, radial_bins and reference can be merged.
+        """
+
+        self.__max_radius, self.__bins, self.__radial_bins = float(max_radius), bins, radial_bins
+        self.__reference = np.array(reference, dtype=float)
+        #sums of w, w*x, w*y, w*(x^2 + y^2), all relative to reference
+        self.__moments = np.zeros(4)
+        self.__count = 0
+        self.__max_r = 0.0
+        self.__hist = np.zeros((bins, bins))
+        #the last radial bin holds everything beyond max_radius
+        self.__radial = np.zeros(radial_bins + 1)
+
+    def __repr__(self):
+        return "spot.SpotStats {{rays: {}, centroid: {}, rms: {:g}, max radius: {:g}}}".format(self.__count, self.centroid(), self.rms(), self.max_radius())
+
+    def __key(self):
+        return (self.__max_radius, self.__bins, self.__radial_bins, tuple(self.__reference))
+
+    def add(self, pts, weights=None):
+        """
+        Adds rays at an (N, 2) (or (N, 3), z is ignored) array of positions, with optional weights (e.g. for pupil apodisation).
+        """
+
+        xy = np.asarray(pts, dtype=float)[:, :2] - self.__reference
+        w = np.ones(len(xy)) if weights is None else np.asarray(weights, dtype=float)
+        r2 = np.sum(xy**2, axis=1)
+
+        self.__moments += [np.sum(w), np.dot(w, xy[:, 0]), np.dot(w, xy[:, 1]), np.dot(w, r2)]
+        self.__count += len(xy)
+        if len(xy):
+            self.__max_r = max(self.__max_r, np.sqrt(np.max(r2)))
+
+        edges = np.linspace(-self.__max_radius, self.__max_radius, self.__bins + 1)
+        self.__hist += np.histogram2d(xy[:, 0], xy[:, 1], bins=(edges, edges), weights=w)[0]
+
+        radial_bin = np.minimum((np.sqrt(r2) / self.__max_radius * self.__radial_bins).astype(int), self.__radial_bins)
+        self.__radial += np.bincount(radial_bin, weights=w, minlength=self.__radial_bins + 1)
+
+    def merge(self, other):
+        """
+        Returns the statistics of the rays of both this and other, which must have the same settings.
+        """
+
+        if self.__key() != other.__key():
+            raise ValueError("Can not merge spot statistics with different settings.")
+        res = SpotStats(self.__max_radius, self.__bins, self.__radial_bins, self.__reference)
+        res.__moments = self.__moments + other.__moments
+        res.__count = self.__count + other.__count
+        res.__max_r = max(self.__max_r, other.__max_r)
+        res.__hist = self.__hist + other.__hist
+        res.__radial = self.__radial + other.__radial
+        return res
+
+    def count(self):
+        """
+        Returns the number of rays added.
+        """
+
+        return self.__count
+
+    def centroid(self):
+        """
+        Returns the (weighted) centroid of the spot.
+        """
+
+        w, wx, wy, wr2 = self.__moments
+        if w == 0:
+            return self.__reference.copy()
+        return self.__reference + np.array([wx, wy]) / w
+
+    def rms(self, about_centroid=True):
+        """
+        Returns the (weighted) RMS radius of the spot, about the centroid, or about the reference point as in opticsutils.spot_size.
+        """
+
+        w, wx, wy, wr2 = self.__moments
+        if w == 0:
+            return np.nan
+        if not about_centroid:
+            return np.sqrt(wr2 / w)
+        return np.sqrt(max(wr2 / w - (wx / w)**2 - (wy / w)**2, 0))
+
+    def max_radius(self):
+        """
+        Returns the geometric radius of the spot: the distance of the furthest ray from the reference point.
+        """
+
+        return self.__max_r
+
+    def encircled_radius(self, fraction=0.8):
+        """
+        Returns the radius about the reference point that encircles the given fraction of the (weighted) rays,
+        interpolated within the radial bins. Returns inf if this lies beyond max_radius.
+        """
+
+        total = np.sum(self.__radial)
+        if total == 0:
+            return np.nan
+        cumulative = np.cumsum(self.__radial[:-1])
+        i = np.searchsorted(cumulative, fraction * total)
+        if i >= self.__radial_bins:
+            return np.inf
+        below = cumulative[i - 1] if i > 0 else 0
+        width = self.__max_radius / self.__radial_bins
+        return (i + (fraction * total - below) / self.__radial[i]) * width
+
+    def histogram(self):
+        """
+        Returns the (weighted) spot histogram, and its bin edges (the same along x and y, relative to the reference point).
+        The histogram is indexed [x, y], and can be used directly as a geometric point spread function.
+        """
+
+        return self.__hist.copy(), np.linspace(-self.__max_radius, self.__max_radius, self.__bins + 1)
+
+def analyse(rays, max_radius=None, weights=None, bins=64, radial_bins=1024, reference=(0, 0)):
+    """
+    Returns the SpotStats of the current positions of the rays that are not terminated.
+    rays: a RayBundle, or a list of rays.
+    max_radius: see SpotStats, defaults to just beyond the furthest ray. Set it explicitly when the results are to be merged.
+    weights: optional weight for each ray (including terminated rays, which are skipped).
+    """
+
+    if isinstance(rays, r.RayBundle):
+        pts, live = rays.pos()[:, :2].astype(float), ~rays.terminated()
+    else:
+        pts = np.array([x.pos()[:2] for x in rays], dtype=float).reshape(-1, 2)
+        live = ~np.array([x.terminated() for x in rays], dtype=bool)
+    pts = pts[live]
+    if not weights is None:
+        weights = np.asarray(weights, dtype=float)[live]
+
+    if max_radius is None:
+        r_max = np.sqrt(np.max(np.sum((pts - np.array(reference))**2, axis=1))) if len(pts) else 0
+        max_radius = r_max * 1.001 if r_max > 0 else 1e-9
+
+    stats = SpotStats(max_radius, bins, radial_bins, reference)
+    stats.add(pts, weights)
+    return stats
@@ -3,8 +3,8 @@
 Testing module.
 """
 
-import numpy as np, matplotlib.pyplot as plt
-import elements as e, graphics as g, opticsutils as ou, ray as r, optimizer as ot
+import numpy as np, subprocess, os
+import elements as e, graphics as g, opticsutils as ou, ray as r, optimizer as ot, materials as m
 
 def t9():
     sys = e.System()
@@ -128,3 +128,417 @@ def rainbow():
     sys.propagate(bundle)
     
     return g.graph_yplane(bundle)
+
+def import_ext(modules=("ray", "elements", "opticsutils", "graphics"), budget=0.5):
+    """
+    Checks that the given modules import within a time budget (seconds), and without pulling in scipy or matplotlib.
+    The import is timed in a fresh interpreter, so modules already loaded here don't hide the cost.
+    Returns the import time.
+    """
+
+    #imported here, as the tests use sys for their optical systems
+    import sys as _sys
+
+    code = "\n".join(["import sys, time",
+                      "t = time.perf_counter()",
+                      "import {}".format(", ".join(modules)),
+                      "print(time.perf_counter() - t)",
+                      "print(','.join(x for x in ('scipy', 'matplotlib') if x in sys.modules))"])
+    out = subprocess.run([_sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                         capture_output=True, text=True, check=True).stdout.split("\n")
+    time, heavy = float(out[0]), out[1]
+
+    if heavy:
+        raise AssertionError("Importing {} also imported {}.".format(", ".join(modules), heavy))
+    if time > budget:
+        raise AssertionError("Importing {} took {:.3f}s, over the budget of {:.3f}s.".format(", ".join(modules), time, budget))
+    return time
+
+def scenarios():
+    """
+    Returns the systems and rays used in the tests above, for numerical checks, as a dictionary of name: (system, rays).
+    The systems only use index objects, so can be saved and pickled.
+    rays is a list of (point, direction, wavelength) tuples.
+    """
+
+    index_func = m.LinearIndex(1.5168, 380e-9, 0.001 / (740e-9 - 380e-9))
+    water = "water"
+    rays = lambda b : [(x.pos(), x.dirn(), x.wavelength()) for x in b]
+
+    return {"t9": (e.System([e.SphericalRefractor(100e-3, 0.03e3, 1, 1.5), e.OutputPlane(250e-3)]),
+                   [([0, (x / 10) * 1e-3, 0], [0, 0, 1], None) for x in range(25)]),
+            "t11": (e.System([e.SphericalRefractor(100e-3, 0.03e3, 1, 1.5), e.OutputPlane(400e-3)]),
+                    [([0, 2e-3, 0], [0, 0, 1], None), ([0, 2e-3, 0], [0, -2e-3, 100e-3], None), ([0, 2e-3, 0], [0, -4e-3, 100e-3], None)]),
+            "t12": (e.System([e.SphericalRefractor(100e-3, 0.03e3, 1, 1.5), e.OutputPlane(250e-3)]), rays(r.bundle(5e-3, 6, 6))),
+            "t15_reverse": (e.System([e.SphericalRefractor(100e-3, 0, 1, 1.5168), e.SphericalRefractor(105e-3, -0.02e3, 1.5168, 1), e.OutputPlane(250e-3)]),
+                            rays(r.bundle(15e-3, 6, 6))),
+            "t15_correct": (e.System([e.SphericalRefractor(100e-3, 0.02e3, 1, 1.5168), e.SphericalRefractor(105e-3, 0, 1.5168, 1), e.OutputPlane(250e-3)]),
+                            rays(r.bundle(15e-3, 6, 6))),
+            "chromatic": (e.System([e.SphericalRefractor(100e-3, 0.02e3, 1, index_func), e.SphericalRefractor(105e-3, 0, index_func, 1), e.OutputPlane(250e-3)]),
+                          rays(r.bundle(10e-3, 6, 6, wavelength=380e-9) + r.bundle(10e-3, 6, 6, wavelength=560e-9) + r.bundle(10e-3, 6, 6, wavelength=740e-9))),
+            "reflecting": (e.System([e.SphericalReflector(100e-3, -0.02e3), e.OutputPlane(-50e-3)]), rays(r.bundle(10e-3, 3, 3))),
+            "rainbow": (e.System([e.SphericalRefractor(10e-3, (1e-3)**-1, 1, water), e.SphericalReflector(12e-3, -(1e-3)**-1),
+                                  e.SphericalRefractor(10e-3, (1e-3)**-1, water, 1), e.OutputPlane(0.0)]),
+                        [([0, 0.9e-3, 0], [0, 0, 20e-3], 380e-9 + (i/10) * (740e-9 - 380e-9)) for i in range(11)]),
+            #edge cases: total internal reflection beyond 6.6mm, rays outside the aperture (3mm) and the sphere (5mm), and mirrors hit from behind
+            #rays are kept off the edges themselves, which float32 can not resolve
+            "tir": (e.System([e.SphericalRefractor(10e-3, 0.1e3, 1.5168, 1), e.OutputPlane(30e-3)]),
+                    [([0, (x / 10) * 1e-3, 0], [0, 0, 1], None) for x in range(0, 100, 5)]),
+            "aperture": (e.System([e.SphericalRefractor(100e-3, 0.2e3, 1, 1.5, apt=3e-3), e.OutputPlane(250e-3)]),
+                         [([0, (x / 2 + 0.1) * 1e-3, 0], [0, 0, 1], None) for x in range(13)]),
+            "wrong_side": (e.System([e.SphericalReflector(100e-3, -0.02e3), e.OutputPlane(-50e-3)]),
+                           [([0, y, 0], [0, 0, 1], None) for y in (1e-3, 5e-3)] + [([0, y, 200e-3], [0, 0, -1], None) for y in (1e-3, 5e-3)])}
+
+def scenario_bundle(rays, dtype=np.float64, record="full"):
+    """
+    Builds a RayBundle from the (point, direction, wavelength) tuples of a scenario.
+    """
+
+    wavelengths = [x[2] for x in rays]
+    wavelength = None if all([x is None for x in wavelengths]) else np.array(wavelengths, dtype=float)
+    return r.RayBundle([x[0] for x in rays], [x[1] for x in rays], wavelength, dtype, record)
+
+def precision_ext(pos_tol=(1e-12, 1e-6), dirn_tol=(1e-12, 1e-5)):
+    """
+    Traces each scenario with Ray objects, and as float64 and float32 RayBundles, and compares every vertex and final direction.
+    pos_tol, dirn_tol: the largest allowed deviations (m, and in unit directions) for (float64, float32).
+
+    Returns a dictionary of name: ((position error, direction error) float64, (position error, direction error) float32).
+    """
+
+    res = {}
+    for name, (sys, rays) in scenarios().items():
+        ref = [r.Ray(*x) for x in rays]
+        sys.propagate(ref)
+
+        errs = []
+        for dtype, p_tol, d_tol in zip((np.float64, np.float32), pos_tol, dirn_tol):
+            bundle = scenario_bundle(rays, dtype)
+            sys.propagate(bundle)
+
+            p_err, d_err = 0, 0
+            for i, x in enumerate(ref):
+                vertices = bundle.vertices(i)
+                if len(vertices) != len(x.vertices()) or bundle.terminated()[i] != x.terminated():
+                    raise AssertionError("{} ({}): ray {} took a different path.".format(name, np.dtype(dtype), i))
+                p_err = max(p_err, np.max(np.abs(np.array(vertices, dtype=float) - np.array(x.vertices()))))
+                d_err = max(d_err, np.max(np.abs(bundle.dirn()[i].astype(float) - x.dirn())))
+
+            if p_err > p_tol or d_err > d_tol:
+                raise AssertionError("{} ({}): position error {:g}, direction error {:g}.".format(name, np.dtype(dtype), p_err, d_err))
+            errs.append((p_err, d_err))
+        res[name] = tuple(errs)
+    return res
+
+GOLDEN = os.path.join("data", "golden.json")
+
+#largest allowed deviations from the golden outputs, as (position in m, unit direction, relative focus and spot size)
+#scalar re-runs the reference path, so only allows for differences in floating point libraries
+#float32 positions are good to ~1e-7m, which is up to ~1e-3 of the smallest (~1e-5m) spots
+#field and parallel only find the spot size (and focus), with the same float64 RayBundle engine as batched
+#there is no compiled engine yet, one should get its own mode here with the float64 tolerances
+GOLDEN_TOLERANCES = {"scalar": (1e-14, 1e-14, 1e-12),
+                     "batched": (1e-12, 1e-12, 1e-9),
+                     "incremental": (1e-12, 1e-12, 1e-9),
+                     "float32": (1e-6, 1e-5, 1e-3),
+                     "field": (0, 0, 1e-9),
+                     "parallel": (0, 0, 1e-9)}
+
+def __golden_path(path):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+
+def __scalar_outputs(sys, rays, optics=True):
+    traced = [r.Ray(*x) for x in rays]
+    sys.propagate(traced)
+    focus = None
+    if optics:
+        try:
+            focus = ou.get_focus(sys)
+        except ValueError:
+            #indices only tabulated over a wavelength range have no paraxial focus
+            optics = False
+    return {"vertices": [np.array(x.vertices()).tolist() for x in traced],
+            "directions": [np.array(x.dirn(), dtype=float).tolist() for x in traced],
+            "terminated": [bool(x.terminated()) for x in traced],
+            "focus": focus if focus in (None, False) else float(focus),
+            "spot": None if not optics else ou.spot_size(sys, focus) if focus else False}
+
+def __bundle_outputs(sys, rays, mode, optics=True):
+    dtype = np.float32 if mode == "float32" else np.float64
+    bundle = scenario_bundle(rays, dtype)
+    if mode == "incremental":
+        #trace, then move the last element to where it was, so only it is traced again from the checkpoint before it
+        sys.trace(bundle)
+        sys.elements()[-1].set(z0=sys.elements()[-1].to_dict()["z0"])
+        bundle = sys.trace(bundle)
+    else:
+        sys.propagate(bundle)
+
+    focus, spot = ou.focus_spot(sys, dtype=dtype) if optics else (None, None)
+    return {"vertices": [np.array(bundle.vertices(i), dtype=float).tolist() for i in range(len(bundle))],
+            "directions": bundle.dirn().astype(float).tolist(),
+            "terminated": bundle.terminated().tolist(),
+            "focus": focus if focus in (None, False) else float(focus),
+            "spot": spot}
+
+def __field_outputs(sys, focus):
+    """
+    The on-axis RMS spot size from field.analyse, at the given focus. The on-axis centroid is on the axis, so this is the spot size.
+    """
+
+    import field
+
+    spot = field.analyse(sys, [0], image_z=focus)["rms"][0]
+    return {"focus": focus, "spot": False if np.isnan(spot) else spot}
+
+def __parallel_outputs(sys, workers=2):
+    """
+    The focus and spot size of a system, found in worker processes by tolerance.analyse, with a tolerance of zero width.
+    """
+
+    import tolerance as tol
+
+    res = tol.analyse(sys, [tol.Tolerance(0, "z0", 0)], n_trials=workers, workers=workers)["samples"]
+    return {x: False if np.isnan(res[x][0]) else res[x][0] for x in ("focus", "spot")}
+
+def __trail_spot(sys, focus):
+    """
+    The RMS spot size at the focus, interpolated from the full trails of a bundle (as in t13, but along the last segment
+    to cross the focal plane, for folded systems), independently of opticsutils.spot_size.
+    The system's output plane must lie beyond the focus. Terminated rays, and rays with no trail at the focus, are left out.
+    """
+
+    bundle = r.bundle(5e-3, 6, 6)
+    sys.propagate(bundle)
+
+    spots = []
+    for x in bundle:
+        pts = np.array(x.vertices())
+        crossing = [i for i in range(len(pts) - 1) if (pts[i, 2] - focus) * (pts[i + 1, 2] - focus) <= 0 and pts[i, 2] != pts[i + 1, 2]]
+        if x.terminated() or not crossing:
+            continue
+        a, b = pts[crossing[-1]], pts[crossing[-1] + 1]
+        spots.append(np.linalg.norm((a + (focus - a[2]) / (b[2] - a[2]) * (b - a))[:2])**2)
+    return np.sqrt(np.average(spots))
+
+def __check_spots(golden, cases, tol):
+    """
+    Checks the spot sizes of a set of outputs against __trail_spot, to relative tolerance tol.
+    """
+
+    for name, (sys, rays) in cases.items():
+        if golden[name]["spot"]:
+            spot = __trail_spot(sys, golden[name]["focus"])
+            if abs(golden[name]["spot"] - spot) > tol * spot:
+                raise AssertionError("{}: spot size {:g}, but {:g} from the ray trails.".format(name, golden[name]["spot"], spot))
+
+def record_golden(path=GOLDEN, spot_tol=1e-9):
+    """
+    Records the outputs of the scalar (Ray object) path for each scenario as the golden outputs checked by golden_ext:
+    every vertex, final directions, whether each ray is terminated, the focus (opticsutils.get_focus) and RMS spot size (opticsutils.spot_size).
+    Only re-record after checking that a change to the scalar path is intended.
+    The spot sizes are first checked against the ray trails, see golden_ext.
+    """
+
+    import json
+
+    golden = {name: __scalar_outputs(sys, rays) for name, (sys, rays) in scenarios().items()}
+    __check_spots(golden, scenarios(), spot_tol)
+    with open(__golden_path(path), "w") as f:
+        json.dump(golden, f)
+    return golden
+
+def golden_ext(modes=("scalar", "batched", "incremental", "float32", "field", "parallel"), path=GOLDEN, spot_tol=1e-9):
+    """
+    Checks each way of tracing the scenarios against the golden outputs recorded by record_golden, within GOLDEN_TOLERANCES.
+    modes:
+        scalar: Ray objects, as the golden outputs were made.
+        batched: float64 RayBundles, with focus and spot size from opticsutils.focus_spot.
+        incremental: as batched, with System.trace re-tracing from a checkpoint.
+        float32: as batched, with float32 RayBundles.
+        field: the on-axis spot size from field.analyse, at the golden focus. Only this is compared.
+        parallel: focus and spot size found by tolerance.analyse in worker processes. Only these are compared.
+
+    The golden spot sizes are first checked, to relative tolerance spot_tol, against the RMS spot interpolated from the
+    full ray trails (as in t13), so that a regression in opticsutils.spot_size can not be locked in by re-recording.
+    Rays must take the same path (number of vertices and termination) in every mode, and the focus and spot must
+    both be found or both not be found. Scenarios without a focus for wavelength None (e.g. tabulated indices) only check the rays. Raises an AssertionError on the first failure.
+    Returns a dictionary of mode: (position error, direction error, relative focus and spot error), the largest over all scenarios.
+    """
+
+    import json
+
+    with open(__golden_path(path)) as f:
+        golden = json.load(f)
+    cases = scenarios()
+    if set(cases) != set(golden):
+        raise AssertionError("Scenarios {} differ from the golden outputs, re-record them.".format(", ".join(set(cases) ^ set(golden))))
+    __check_spots(golden, cases, spot_tol)
+
+    res = {}
+    for mode in modes:
+        #focus and spot size are only checked where they were found for the golden outputs
+        optics = [name for name in cases if not golden[name]["focus"] is None]
+        if mode == "parallel":
+            outputs = {name: __parallel_outputs(cases[name][0]) for name in optics}
+        elif mode == "field":
+            outputs = {name: __field_outputs(cases[name][0], golden[name]["focus"]) for name in optics if golden[name]["focus"]}
+        elif mode == "scalar":
+            outputs = {name: __scalar_outputs(*x, name in optics) for name, x in cases.items()}
+        elif mode in GOLDEN_TOLERANCES:
+            outputs = {name: __bundle_outputs(*x, mode, name in optics) for name, x in cases.items()}
+        else:
+            raise ValueError("Unknown mode: {}.".format(mode))
+
+        p_tol, d_tol, rel_tol = GOLDEN_TOLERANCES[mode]
+        p_err, d_err, rel_err = 0, 0, 0
+        for name, out in outputs.items():
+            ref = golden[name]
+            for key in ("focus", "spot"):
+                if ref[key] is None:
+                    continue
+                if (out[key] is False) != (ref[key] is False):
+                    raise AssertionError("{} ({}): {} is {}, expected {}.".format(name, mode, key, out[key], ref[key]))
+                if not ref[key] is False:
+                    rel_err = max(rel_err, abs(out[key] - ref[key]) / abs(ref[key]))
+
+            if not "vertices" in out:
+                continue
+            for i, (vertices, terminated) in enumerate(zip(ref["vertices"], ref["terminated"])):
+                if len(out["vertices"][i]) != len(vertices) or out["terminated"][i] != terminated:
+                    raise AssertionError("{} ({}): ray {} took a different path.".format(name, mode, i))
+                p_err = max(p_err, np.max(np.abs(np.array(out["vertices"][i]) - vertices)))
+            d_err = max(d_err, np.max(np.abs(np.array(out["directions"]) - ref["directions"])))
+
+        if p_err > p_tol or d_err > d_tol or rel_err > rel_tol:
+            raise AssertionError("{}: position error {:g}, direction error {:g}, focus and spot error {:g}.".format(mode, p_err, d_err, rel_err))
+        res[mode] = (p_err, d_err, rel_err)
+    return res
+
+def asphere_ext(n_rays=2000, seed=0, samples=20000, tol=1e-9):
+    """
+    Checks aspheric intercepts against a bracketed root of the surface equation, found independently of the element,
+    for tilted rays on a surface with strong aspheric terms (where Newton's method alone does not always converge).
+    Every ray must hit or miss as for the reference, and hits must agree to tol (m).
+    Returns the number of hits, and the largest error.
+    """
+
+    c, k, coeffs, z0, apt = -30, 0.5, (-5e3, 1e5), 100e-3, 26e-3
+    elem = e.AsphericRefractor(z0, c, 1, 1.5, k, coeffs, apt)
+    sag = lambda s : c * s / (1 + np.sqrt(1 - (1 + k) * c**2 * s)) + coeffs[0] * s**2 + coeffs[1] * s**3
+
+    rng = np.random.default_rng(seed)
+    pos = np.column_stack([rng.uniform(-30e-3, 30e-3, n_rays), rng.uniform(-30e-3, 30e-3, n_rays), np.zeros(n_rays)])
+    dirn = np.column_stack([rng.normal(0, 0.3, n_rays), rng.normal(0, 0.3, n_rays), np.ones(n_rays)])
+    dirn /= np.linalg.norm(dirn, axis=1)[:, None]
+    pts, hit = elem._intercepts(pos, dirn)
+
+    ls = np.linspace(0, 0.5, samples)
+    f = lambda l, i : pos[i, 2] + l * dirn[i, 2] - z0 - sag((pos[i, 0] + l * dirn[i, 0])**2 + (pos[i, 1] + l * dirn[i, 1])**2)
+    n_hits, err = 0, 0
+    for i in range(n_rays):
+        #roots are bracketed wherever the conic is defined, the first within the aperture is the intercept
+        with np.errstate(invalid="ignore"):
+            f_s = f(ls, i)
+        change = np.flatnonzero(np.isfinite(f_s[:-1]) & np.isfinite(f_s[1:]) & (np.sign(f_s[:-1]) * np.sign(f_s[1:]) <= 0))
+        ref = None
+        for j in change:
+            a, b, f_a = ls[j], ls[j + 1], f_s[j]
+            for n in range(100):
+                mid = (a + b) / 2
+                if np.sign(f(mid, i)) * np.sign(f_a) <= 0:
+                    b = mid
+                else:
+                    a, f_a = mid, f(mid, i)
+            pt = pos[i] + (a + b) / 2 * dirn[i]
+            if np.hypot(pt[0], pt[1]) <= apt:
+                ref = pt
+                break
+
+        if ref is None:
+            if hit[i]:
+                raise AssertionError("Ray {} hits the surface, but has no bracketed root.".format(i))
+            continue
+        if not hit[i]:
+            raise AssertionError("Ray {} misses the surface, but has a bracketed root at {}.".format(i, ref))
+        n_hits += 1
+        err = max(err, np.max(np.abs(pts[i] - ref)))
+
+    if err > tol:
+        raise AssertionError("Intercepts differ from the bracketed roots by up to {:g}m.".format(err))
+    return n_hits, err
+
+def __fibre_reference(pos, dirn, z0, length, radius, n_ext, n_core, n_clad):
+    """
+    Traces a single ray through a fibre reflection by reflection, returning (status, final point, final direction) as for elements.Fibre._trace.
+    """
+
+    face = np.array([0, 0, -1.0])
+    l = (z0 - pos[2]) / dirn[2] if dirn[2] > 0 else -1
+    pt = pos + l * dirn
+    if l < 0 or np.hypot(pt[0], pt[1]) > radius:
+        return 0, None, None
+    if np.sqrt(1 - dirn[2]**2) > n_core / n_ext:
+        return 3, pt, dirn * [1, 1, -1]
+    d = ou.refract(dirn, face, n_ext, n_core)
+
+    while True:
+        t_exit = (z0 + length - pt[2]) / d[2]
+        a, b, c = d[0]**2 + d[1]**2, pt[0] * d[0] + pt[1] * d[1], pt[0]**2 + pt[1]**2 - radius**2
+        t_wall = (-b + np.sqrt(max(b**2 - a * c, 0))) / a if a > 0 else np.inf
+        if t_wall >= t_exit:
+            pt = pt + t_exit * d
+            break
+        pt = pt + t_wall * d
+        normal = np.array([pt[0], pt[1], 0]) / radius
+        cos_i = abs(np.dot(d, normal))
+        if n_core**2 * (1 - cos_i**2) <= n_clad**2:
+            return 2, pt, d
+        d = d - 2 * np.dot(d, normal) * normal
+
+    #total internal reflection at the exit face
+    tir = np.sqrt(1 - np.dot(d, -face)**2) > n_ext / n_core
+    return (4 if tir else 1), pt, ou.refract(d, face, n_core, n_ext)
+
+def fibre_ext(n_rays=500, seed=0, pos_tol=1e-9, dirn_tol=1e-9):
+    """
+    Checks elements.Fibre (batched list and RayBundle paths) against a per-reflection reference trace, for a step-index fibre
+    a light pipe (n_clad = 1) and a light pipe in a denser medium, with rays that miss the core, are guided (meridional and skew),
+    escape into the cladding, or are reflected at the entry face.
+    Every ray must have the same outcome, and final points (m) and directions must agree to the tolerances.
+    Returns a dictionary of name: (counts of each elements.Fibre._trace status, position error, direction error).
+    """
+
+    rng = np.random.default_rng(seed)
+    res = {}
+    for name, (z0, length, radius, n_ext, n_core, n_clad) in {"step_index": (10e-3, 0.2, 0.5e-3, 1, 1.48, 1.46),
+                                                             "light_pipe": (10e-3, 0.1, 2e-3, 1, 1.5, 1),
+                                                             "immersed": (10e-3, 0.1, 2e-3, 2.4, 1.5, 1)}.items():
+        fibre = e.Fibre(z0, length, radius, n_core, n_clad, n_ext)
+        #rays aimed at points around the entry face, from 1mm before it
+        dirn = np.column_stack([rng.normal(0, 0.3, (n_rays, 2)), np.ones(n_rays)])
+        dirn /= np.linalg.norm(dirn, axis=1)[:, None]
+        pos = np.column_stack([rng.uniform(-1.2, 1.2, (n_rays, 2)) * radius, np.full(n_rays, z0)]) - 1e-3 * dirn / dirn[:, 2:]
+        ref = [__fibre_reference(p, d, z0, length, radius, n_ext, n_core, n_clad) for p, d in zip(pos, dirn)]
+
+        rays, rays_in = [r.Ray(p, d) for p, d in zip(pos, dirn)], [r.Ray(p, d) for p, d in zip(pos, dirn)]
+        fibre.propagate(rays)
+        bundle = r.RayBundle(pos, dirn)
+        fibre.propagate(bundle)
+
+        p_err, d_err = 0, 0
+        for i, (status, pt, d) in enumerate(ref):
+            for label, vertices, terminated, final_dirn in (("rays", rays[i].vertices(), rays[i].terminated(), rays[i].dirn()),
+                                                            ("bundle", bundle.vertices(i), bundle.terminated()[i], bundle.dirn()[i])):
+                if len(vertices) != (1 if status == 0 else 3) or terminated != (status >= 2):
+                    raise AssertionError("{} ({}): ray {} has a different outcome from the reference, {}.".format(name, label, i, status))
+                if status != 0:
+                    p_err = max(p_err, np.max(np.abs(np.array(vertices[-1]) - pt)))
+                    d_err = max(d_err, np.max(np.abs(final_dirn - d / np.linalg.norm(d))))
+
+        if np.any(fibre.accepts(rays_in) != np.isin([x[0] for x in ref], (1, 4))):
+            raise AssertionError("{}: accepts differs from the reference.".format(name))
+        if p_err > pos_tol or d_err > dirn_tol:
+            raise AssertionError("{}: position error {:g}, direction error {:g}.".format(name, p_err, d_err))
+        res[name] = (tuple(np.bincount([x[0] for x in ref], minlength=5)), p_err, d_err)
+    return res
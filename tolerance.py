@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+A module for Monte Carlo tolerance analysis of optical systems.
+
+Each trial is traced as a single RayBundle, and trials can be split across a pool of worker processes.
+"""
+
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import elements as e, opticsutils as ou
+
+class Tolerance:
+    """
+    Describes a manufacturing tolerance: a single random offset, applied to one or more parameters of the elements.
+    """
+
+    def __init__(self, element, parameter, width=None, distribution="normal"):
+        """
+        element: index of the element in the system.
+        parameter: name of the parameter to vary, any keyword accepted by the element's perturb method (e.g. "z0", "curvature", "n2").
+        width: standard deviation of a normal distribution, or half-width of a uniform distribution.
+        distribution: either "normal" or "uniform".
+
+        Several parameters can take the same offset, by giving a list of (element, parameter) pairs in place of element,
+        followed by the width and distribution, e.g. Tolerance([(0, "n2"), (1, "n1")], 1e-3) for the index of the glass in a
+        singlet, or Tolerance([(0, "z0"), (1, "z0")], 0.1e-3) for its position.
+        """
+
+        if isinstance(element, (list, tuple)):
+            targets, width, distribution = element, parameter, distribution if width is None else width
+        else:
+            targets = [(element, parameter)]
+        if not distribution in ("normal", "uniform"):
+            raise ValueError("Unknown distribution: {}.".format(distribution))
+        self.targets, self.width, self.distribution = [tuple(x) for x in targets], width, distribution
+
+    def __repr__(self):
+        if len(self.targets) == 1:
+            return "tolerance.Tolerance({}, \"{}\", {:g}, \"{}\")".format(*self.targets[0], self.width, self.distribution)
+        return "tolerance.Tolerance({}, {:g}, \"{}\")".format(self.targets, self.width, self.distribution)
+
+    def sample(self, rng, n):
+        """
+        Draws n offsets for the parameter from a numpy random generator.
+        """
+
+        if self.distribution == "normal":
+            return rng.normal(0, self.width, n)
+        else:
+            return rng.uniform(-self.width, self.width, n)
+
+def perturb(sys, tolerances, offsets):
+    """
+    Returns a new system with the offsets applied to the toleranced parameters.
+    offsets should have one entry per tolerance, offsets on the same parameter are summed.
+    """
+
+    deltas = {}
+    for tol, offset in zip(tolerances, offsets):
+        for element, parameter in tol.targets:
+            params = deltas.setdefault(element, {})
+            params[parameter] = params.get(parameter, 0) + offset
+
+    return e.System(elements=[x.perturb(**deltas[i]) if i in deltas else x for i, x in enumerate(sys.elements())])
+
+def _evaluate(sys, bundle_radius):
+    """
+    Returns (focus, RMS spot size) for a system from opticsutils.focus_spot, with nan for those that are not found.
+    """
+
+    return tuple(np.nan if x is False else x for x in ou.focus_spot(sys, bundle_radius=bundle_radius))
+
+def _trials(sys, tolerances, offsets, bundle_radius):
+    """
+    Evaluates the systems perturbed by each row of offsets, returning an (N, 2) array of (focus, spot size).
+    """
+
+    return np.array([_evaluate(perturb(sys, tolerances, row), bundle_radius) for row in offsets]).reshape(-1, 2)
+
+def __statistics(values, percentiles):
+    """
+    Utility method summarising a set of samples, ignoring those that did not converge.
+    """
+
+    if np.all(np.isnan(values)):
+        return {"mean": np.nan, "std": np.nan, "percentiles": {p: np.nan for p in percentiles}}
+    return {"mean": np.nanmean(values), "std": np.nanstd(values),
+            "percentiles": dict(zip(percentiles, np.nanpercentile(values, percentiles)))}
+
+def __sensitivity(offsets, widths, values):
+    """
+    Utility method fitting a linear model of values against the offsets (in units of their tolerance widths).
+    Returns the coefficient for each parameter: the change in value for a one-width change in that parameter.
+    """
+
+    #parameters held fixed by a zero width have no sensitivity to fit
+    coef = np.full(offsets.shape[1], np.nan)
+    ok, varied = ~np.isnan(values), widths != 0
+    if np.count_nonzero(ok) <= np.count_nonzero(varied):
+        return coef
+    x = np.column_stack([offsets[ok][:, varied] / widths[varied], np.ones(np.count_nonzero(ok))])
+    coef[varied] = np.linalg.lstsq(x, values[ok], rcond=None)[0][:-1]
+    return coef
+
+def analyse(sys, tolerances, n_trials=1000, seed=0, bundle_radius=5e-3, percentiles=(5, 50, 95), workers=None):
+    """
+    Runs a Monte Carlo tolerance analysis on a system.
+    tolerances: a list of Tolerance objects.
+    n_trials: the number of perturbed systems to evaluate.
+    seed: seed for the random generator, the same seed always produces the same set of systems.
+    bundle_radius: the radius of the bundle used to estimate spot size.
+    percentiles: the percentiles of focus and spot size to report.
+    workers: if given, the trials are split between this many worker processes. The system must then only use index
+             objects from the materials module, so it can be sent to them. The results do not depend on workers.
+
+    Returns a dictionary with the nominal (focus, spot size), the fraction of systems that converged,
+    statistics for focus and spot size, the raw samples, and a sensitivity ranking.
+    The ranking is a list of (tolerance, focus coefficient, spot coefficient) sorted by decreasing effect on spot size,
+    where each coefficient is the change produced by a one-width change in that parameter (nan for a zero width).
+    """
+
+    rng = np.random.default_rng(seed)
+    offsets = np.column_stack([x.sample(rng, n_trials) for x in tolerances])
+    widths = np.array([x.width for x in tolerances])
+
+    if workers is None:
+        results = _trials(sys, tolerances, offsets, bundle_radius)
+    else:
+        chunks = np.array_split(offsets, workers)
+        with ProcessPoolExecutor(workers) as pool:
+            results = np.vstack(list(pool.map(_trials, [sys] * workers, [tolerances] * workers, chunks, [bundle_radius] * workers)))
+    focus, spot = results[:, 0], results[:, 1]
+
+    focus_coef = __sensitivity(offsets, widths, focus)
+    spot_coef = __sensitivity(offsets, widths, spot)
+    ranking = sorted(zip(tolerances, focus_coef, spot_coef), key=lambda x : -abs(x[2]) if not np.isnan(x[2]) else 0)
+
+    return {"nominal": _evaluate(sys, bundle_radius),
+            "converged": np.count_nonzero(~np.isnan(spot)) / n_trials,
+            "focus": __statistics(focus, percentiles),
+            "spot": __statistics(spot, percentiles),
+            "samples": {"offsets": offsets, "focus": focus, "spot": spot},
+            "sensitivity": ranking}